@@ -0,0 +1 @@
+"""Офлайн-бенчмарки и нагрузочные тесты бота с локальной заглушкой внешних API."""
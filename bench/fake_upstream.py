@@ -0,0 +1,252 @@
+"""
+Локальная заглушка OpenWeatherMap и NOAA SWPC для бенчмарков.
+
+Отдаёт записанные (или сгенерированные) ответы /weather, /forecast, /group,
+/air_pollution, xray-1-day.json и planetary_k_index_1m.json с настраиваемой
+задержкой и долей ошибок и считает обращения к каждому маршруту.
+
+Запуск отдельно:  python -m bench.fake_upstream --port 8081 --latency 80
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+
+# Базовая отметка времени для детерминированных ответов
+BASE_DT = 1700000000
+
+# Несколько известных городов; остальные названия генерируются по хешу
+KNOWN_CITIES = {
+    "киев": (703448, "Kyiv", "UA", 50.4333, 30.5167, 7200),
+    "kyiv": (703448, "Kyiv", "UA", 50.4333, 30.5167, 7200),
+    "львов": (702550, "Lviv", "UA", 49.8383, 24.0232, 7200),
+    "lviv": (702550, "Lviv", "UA", 49.8383, 24.0232, 7200),
+    "одесса": (698740, "Odesa", "UA", 46.4775, 30.7326, 7200),
+    "odesa": (698740, "Odesa", "UA", 46.4775, 30.7326, 7200),
+    "london": (2643743, "London", "GB", 51.5085, -0.1257, 0),
+}
+
+
+def _city_by_name(name):
+    key = (name or "").strip().casefold()
+    if key.startswith("nowhere"):
+        return None
+    if key in KNOWN_CITIES:
+        return KNOWN_CITIES[key]
+    city_id = 1000000 + zlib.crc32(key.encode()) % 1000000
+    return _city_by_id(city_id, name.strip().title())
+
+
+def _city_by_id(city_id, name=None):
+    for city in KNOWN_CITIES.values():
+        if city[0] == city_id:
+            return city
+    rnd = random.Random(city_id)
+    return (city_id, name or f"City{city_id}", "XX",
+            round(rnd.uniform(-60, 60), 4), round(rnd.uniform(-180, 180), 4), rnd.choice((-18000, 0, 3600, 7200, 32400)))
+
+
+def current_payload(city):
+    city_id, name, country, lat, lon, tz = city
+    rnd = random.Random(city_id)
+    return {
+        "coord": {"lon": lon, "lat": lat},
+        "weather": [{"id": 804, "main": "Clouds", "description": "пасмурно", "icon": "04d"}],
+        "main": {"temp": round(rnd.uniform(-10, 30), 2), "feels_like": round(rnd.uniform(-15, 30), 2),
+                 "temp_min": 1.0, "temp_max": 5.0, "pressure": 1012, "humidity": rnd.randint(30, 95)},
+        "wind": {"speed": round(rnd.uniform(0, 12), 2), "deg": 200},
+        "clouds": {"all": 90},
+        "dt": BASE_DT,
+        "sys": {"country": country, "sunrise": BASE_DT - 20000, "sunset": BASE_DT + 20000},
+        "timezone": tz,
+        "id": city_id,
+        "name": name,
+        "cod": 200,
+    }
+
+
+def forecast_payload(city):
+    city_id, name, country, lat, lon, tz = city
+    rnd = random.Random(city_id + 1)
+    items = []
+    for i in range(40):
+        dt = BASE_DT + i * 10800
+        temp = round(rnd.uniform(-10, 30), 2)
+        rain = rnd.random() < 0.3
+        items.append({
+            "dt": dt,
+            "main": {"temp": temp, "feels_like": temp - 2, "temp_min": temp - 1, "temp_max": temp + 1,
+                     "pressure": 1012, "humidity": rnd.randint(30, 95)},
+            "weather": [{"id": 500, "main": "Rain", "description": "небольшой дождь", "icon": "10d"} if rain else
+                        {"id": 803, "main": "Clouds", "description": "облачно с прояснениями", "icon": "04d"}],
+            "clouds": {"all": 75},
+            "wind": {"speed": round(rnd.uniform(0, 12), 2), "deg": 180},
+            "pop": 0.4 if rain else 0,
+            "dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt)),
+        })
+    return {
+        "cod": "200", "message": 0, "cnt": len(items), "list": items,
+        "city": {"id": city_id, "name": name, "coord": {"lat": lat, "lon": lon}, "country": country,
+                 "timezone": tz, "sunrise": BASE_DT - 20000, "sunset": BASE_DT + 20000},
+    }
+
+
+def air_payload(lat, lon):
+    return {
+        "coord": {"lon": lon, "lat": lat},
+        "list": [{"main": {"aqi": 2},
+                  "components": {"co": 230.3, "no": 0.1, "no2": 11.2, "o3": 48.6, "so2": 1.4,
+                                 "pm2_5": 5.1, "pm10": 9.8, "nh3": 0.7},
+                  "dt": BASE_DT}],
+    }
+
+
+def xray_payload():
+    return [{"time_tag": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(BASE_DT - 60 * (1440 - i))),
+             "satellite": 16, "flux": 1.2e-6, "observed_flux": 1.2e-6, "electron_correction": 0.0,
+             "electron_contaminaton": False, "energy": "0.1-0.8nm"} for i in range(1440)]
+
+
+def kp_payload():
+    return [{"time_tag": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(BASE_DT - 60 * (60 - i))),
+             "kp_index": 3, "estimated_kp": 2.67, "kp": "3M"} for i in range(60)]
+
+
+class FakeUpstream:
+    """
+    Заглушка внешних API: маршруты aiohttp, задержки, ошибки и счётчики вызовов.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, fixtures_dir=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._fixtures = {}
+        if fixtures_dir:
+            for filename in os.listdir(fixtures_dir):
+                if filename.endswith(".json"):
+                    with open(os.path.join(fixtures_dir, filename), encoding="utf-8") as f:
+                        self._fixtures[filename[:-5]] = json.load(f)
+        self._xray = self._fixtures.get("xray-1-day") or xray_payload()
+        self._kp = self._fixtures.get("planetary_k_index_1m") or kp_payload()
+
+    def reset(self):
+        self.calls.clear()
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    async def _delay_or_fail(self, route):
+        self.calls[route] += 1
+        delay = max(0.0, self._random.gauss(self.latency, self.jitter)) if self.latency else 0.0
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise web.HTTPInternalServerError(text='{"cod": 500, "message": "fake upstream error"}')
+
+    def _resolve(self, query):
+        if "id" in query:
+            return _city_by_id(int(query["id"]))
+        if "q" in query:
+            return _city_by_name(query["q"])
+        return _city_by_id(int(abs(float(query["lat"])) * 1000 + abs(float(query["lon"]))))
+
+    def _with_fixture(self, name, payload):
+        fixture = self._fixtures.get(name)
+        if fixture is None:
+            return payload
+        if isinstance(payload, dict) and isinstance(fixture, dict):
+            # Записанный ответ, но с полями конкретного города
+            merged = dict(fixture)
+            for field in ("coord", "id", "name", "sys", "timezone", "city"):
+                if field in payload:
+                    merged[field] = payload[field]
+            return merged
+        return fixture
+
+    async def weather(self, request):
+        await self._delay_or_fail("weather")
+        city = self._resolve(request.query)
+        if city is None:
+            return web.json_response({"cod": "404", "message": "city not found"}, status=404)
+        return web.json_response(self._with_fixture("weather", current_payload(city)))
+
+    async def forecast(self, request):
+        await self._delay_or_fail("forecast")
+        city = self._resolve(request.query)
+        if city is None:
+            return web.json_response({"cod": "404", "message": "city not found"}, status=404)
+        return web.json_response(self._with_fixture("forecast", forecast_payload(city)))
+
+    async def group(self, request):
+        await self._delay_or_fail("group")
+        ids = [int(city_id) for city_id in request.query["id"].split(",") if city_id]
+        if len(ids) > 20:
+            return web.json_response({"cod": "400", "message": "too many ids"}, status=400)
+        items = [current_payload(_city_by_id(city_id)) for city_id in ids]
+        return web.json_response({"cnt": len(items), "list": items})
+
+    async def air_pollution(self, request):
+        await self._delay_or_fail("air_pollution")
+        lat, lon = float(request.query["lat"]), float(request.query["lon"])
+        return web.json_response(self._fixtures.get("air_pollution") or air_payload(lat, lon))
+
+    async def xray(self, request):
+        await self._delay_or_fail("xray-1-day")
+        return web.json_response(self._xray)
+
+    async def kp(self, request):
+        await self._delay_or_fail("planetary_k_index_1m")
+        return web.json_response(self._kp)
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", self.weather)
+        app.router.add_get("/data/2.5/forecast", self.forecast)
+        app.router.add_get("/data/2.5/group", self.group)
+        app.router.add_get("/data/2.5/air_pollution", self.air_pollution)
+        app.router.add_get("/json/goes/primary/xray-1-day.json", self.xray)
+        app.router.add_get("/json/planetary_k_index_1m.json", self.kp)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Запускает сервер и возвращает его базовый адрес.
+        """
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка OpenWeatherMap/NOAA для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=50, help="средняя задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=20, help="разброс задержки, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--fixtures", help="каталог с записанными ответами (weather.json, forecast.json, ...)")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.latency / 1000, args.jitter / 1000, args.error_rate, args.fixtures)
+    web.run_app(upstream.create_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
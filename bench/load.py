@@ -0,0 +1,178 @@
+"""
+Нагрузочный тест weather_message без Telegram и без ключей API.
+
+Поднимает локальную заглушку внешних API, направляет на неё бота и
+отправляет N поддельных обновлений Telegram с заданной степенью
+параллелизма. Печатает пропускную способность, p50/p95/p99 задержки
+и число обращений к внешним API на один запрос.
+
+Запуск:  python -m bench.load --requests 500 --concurrency 50 --latency 80
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.fake_upstream import FakeUpstream
+
+
+DEFAULT_CITIES = ["Киев", "Kyiv", "Львов", "Odesa", "London", "Paris", "Berlin", "Tokyo", "Nowhere-123"]
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeMessage:
+    """Сообщение Telegram, которое только запоминает ответы бота."""
+
+    def __init__(self, text, send_latency=0.0):
+        self.text = text
+        self.send_latency = send_latency
+        self.replies = []
+
+    async def _send(self, text, markdown):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.replies.append((text, markdown))
+
+    async def reply_text(self, text, **kwargs):
+        await self._send(text, False)
+
+    async def reply_markdown_v2(self, text, **kwargs):
+        await self._send(text, True)
+
+
+class FakeUpdate:
+    """Минимальная замена telegram.Update для обработчика weather_message."""
+
+    def __init__(self, text, chat_id, send_latency=0.0):
+        self.message = FakeMessage(text, send_latency)
+        self.effective_chat = FakeChat(chat_id)
+        self.effective_user = self.effective_chat
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def configure_bot_environment(base_url, cache_dir):
+    """
+    Направляет бота на заглушку и отключает всё, что мешает измерениям.
+    Вызывается до импорта main.
+    """
+    os.environ.update({
+        "OWM_BASE_URL": base_url,
+        "NOAA_BASE_URL": base_url,
+        "OPENWEATHER_API_KEY": os.environ.get("OPENWEATHER_API_KEY", "bench"),
+        "AIR_QUALITY_API_KEY": os.environ.get("AIR_QUALITY_API_KEY", "bench"),
+        "CITY_CACHE_PATH": os.path.join(cache_dir, "bench_cache.sqlite3"),
+        "SUBSCRIPTIONS_PATH": os.path.join(cache_dir, "bench_subscriptions.sqlite3"),
+        "METRICS_PORT": "0",
+        "USER_RATE_BURST": "1000000",
+        "OWM_CALLS_PER_MINUTE": "100000000",
+        "OWM_CALLS_PER_DAY": "100000000",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+
+
+async def run_round(bot, upstream, cities, requests, concurrency, send_latency):
+    """
+    Отправляет requests обновлений не более чем по concurrency одновременно.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(index):
+        nonlocal failures
+        update = FakeUpdate(cities[index % len(cities)], chat_id=index, send_latency=send_latency)
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.weather_message(update, None)
+            latencies.append(time.perf_counter() - started)
+        if not any(markdown for _, markdown in update.message.replies):
+            failures += 1
+
+    upstream.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "failed_replies": failures,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "upstream_calls": upstream.total_calls,
+        "upstream_calls_per_request": round(upstream.total_calls / requests, 3) if requests else 0.0,
+        "upstream_calls_by_route": dict(upstream.calls),
+    }
+
+
+def print_report(title, report):
+    print(f"\n== {title} ==")
+    for key, value in report.items():
+        print(f"{key:>28}: {value}")
+
+
+async def run(args):
+    upstream = FakeUpstream(args.latency / 1000, args.jitter / 1000, args.error_rate, args.fixtures)
+    base_url = await upstream.start()
+    cache_dir = tempfile.mkdtemp(prefix="weather-bench-")
+    configure_bot_environment(base_url, cache_dir)
+    bot = importlib.import_module("main")
+    bot.metrics.setup_logging(os.environ["LOG_LEVEL"])
+
+    cities = args.cities.split(",") if args.cities else DEFAULT_CITIES
+    reports = []
+    try:
+        await bot.open_http_session()
+        # Снимок космической погоды в боте обновляет job queue - делаем то же самое
+        await bot.refresh_space_weather()
+        for round_index in range(args.rounds):
+            report = await run_round(bot, upstream, cities, args.requests, args.concurrency, args.send_latency / 1000)
+            title = "холодный кэш" if round_index == 0 else f"тёплый кэш, проход {round_index + 1}"
+            reports.append({"round": title, **report})
+            if not args.json:
+                print_report(title, report)
+    finally:
+        await bot.close_http_session()
+        await upstream.stop()
+
+    if args.json:
+        json.dump(reports, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест weather_message с заглушкой внешних API")
+    parser.add_argument("--requests", type=int, default=200, help="число обновлений за проход")
+    parser.add_argument("--concurrency", type=int, default=20, help="одновременных обработчиков")
+    parser.add_argument("--rounds", type=int, default=2, help="число проходов (первый - с холодным кэшем)")
+    parser.add_argument("--latency", type=float, default=50, help="средняя задержка внешних API, мс")
+    parser.add_argument("--jitter", type=float, default=20, help="разброс задержки внешних API, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500 от внешних API")
+    parser.add_argument("--send-latency", type=float, default=0, help="задержка отправки в Telegram, мс")
+    parser.add_argument("--cities", help="список городов через запятую")
+    parser.add_argument("--fixtures", help="каталог с записанными ответами API")
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
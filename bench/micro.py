@@ -0,0 +1,60 @@
+"""
+Микробенчмарки форматирования ответа.
+
+Измеряют format_weather_message, escape_markdown и путь через кэш готовых
+ответов на типичных данных, чтобы ловить регрессии до выкладки.
+
+Запуск:  python -m bench.micro --number 2000
+"""
+import argparse
+import os
+import tempfile
+import timeit
+
+from bench.fake_upstream import KNOWN_CITIES, air_payload, current_payload, forecast_payload
+from forecast import CompactForecast
+
+
+def build_report():
+    city = KNOWN_CITIES["kyiv"]
+    air = air_payload(city[3], city[4])
+    return {
+        "current": current_payload(city),
+        "forecast": CompactForecast.from_payload(forecast_payload(city)),
+        "air": air,
+        "solar": {"flare_class": "C", "flare_time": "2023-11-14T22:00:00Z", "intensity": 1.2e-6},
+        "radiation": {"uv_index": 2, "components": air["list"][0]["components"]},
+    }
+
+
+def bench(name, func, number, repeat):
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f"{name:>36}: {best * 1e6:10.2f} мкс/вызов")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки форматирования ответа")
+    parser.add_argument("--number", type=int, default=2000, help="вызовов в одном замере")
+    parser.add_argument("--repeat", type=int, default=5, help="число замеров (берётся лучший)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENWEATHER_API_KEY", "bench")
+    os.environ.setdefault("AIR_QUALITY_API_KEY", "bench")
+    os.environ.setdefault("CITY_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="weather-bench-"), "cache.sqlite3"))
+    import main as bot
+
+    report = build_report()
+    raw_text = bot.format_weather_message(
+        report["current"], report["forecast"], report["air"], report["solar"], report["radiation"]
+    ).replace("\\", "")
+
+    bench("escape_markdown", lambda: bot.escape_markdown(raw_text), args.number, args.repeat)
+    bench("format_weather_message", lambda: bot.format_weather_message(
+        report["current"], report["forecast"], report["air"], report["solar"], report["radiation"]
+    ), args.number, args.repeat)
+    bench("render_weather_reply (кэш)", lambda: bot.render_weather_reply(report), args.number, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+# --- Примитивы кэширования ---
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы (single-flight).
+
+    Пока запрос с данным ключом выполняется, все остальные вызовы с тем же
+    ключом ждут его результат вместо отправки собственного запроса.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def run(self, key, func, *args, **kwargs):
+        """
+        Выполняет func(*args, **kwargs) или присоединяется к уже идущему вызову.
+        Отмена одного из ожидающих не отменяет общий запрос для остальных.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Забираем исключение, даже если все ожидающие уже ушли по таймауту
+        if not task.cancelled():
+            task.exception()
+
+
+class FrequencyTracker:
+    """
+    Счётчик частоты обращений по ключу с экспоненциальным затуханием.
+
+    Вес обращения удваивается каждые half_life секунд, поэтому свежие
+    обращения весят больше старых без пересчёта всех счётчиков. Число
+    ключей ограничено: при переполнении отбрасываются самые редкие.
+    """
+
+    def __init__(self, max_keys=1000, half_life=3600.0):
+        self.max_keys = max_keys
+        self.half_life = half_life
+        self._origin = None
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _weight(self, now):
+        return 2.0 ** ((now - self._origin) / self.half_life)
+
+    def record(self, key, value=None, now=None, count=1):
+        """
+        Учитывает count обращений к key. value - произвольные данные ключа
+        (например, разрешённое место), которые вернёт top().
+        """
+        now = time.monotonic() if now is None else now
+        if self._origin is None:
+            self._origin = now
+        weight = self._weight(now)
+        if weight > 1e100:
+            # Переносим начало отсчёта, пока веса не переполнились
+            for entry in self._entries.values():
+                entry[0] /= weight
+            self._origin = now
+            weight = 1.0
+        weight *= count
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [weight, value]
+            if len(self._entries) > self.max_keys:
+                self._trim()
+        else:
+            entry[0] += weight
+            if value is not None:
+                entry[1] = value
+
+    def _trim(self):
+        # Удаляем сразу десятую часть, чтобы не сортировать при каждом новом ключе
+        excess = len(self._entries) - self.max_keys * 9 // 10
+        for key in heapq.nsmallest(excess, self._entries, key=lambda k: self._entries[k][0]):
+            del self._entries[key]
+
+    def top(self, n, now=None):
+        """
+        Возвращает до n самых частых ключей: список (key, value, счёт), где счёт -
+        число обращений с учётом затухания на текущий момент.
+        """
+        if not self._entries:
+            return []
+        weight = self._weight(time.monotonic() if now is None else now)
+        best = heapq.nlargest(n, self._entries.items(), key=lambda item: item[1][0])
+        return [(key, value, score / weight) for key, (score, value) in best]
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов внешних API.
+
+    Первый уровень - словарь в памяти с вытеснением давно не использованных
+    записей (LRU) и своим временем жизни для каждого источника. Второй,
+    необязательный уровень - файл SQLite, чтобы после перезапуска бот
+    не начинал с пустого кэша. Запись на диск не блокирует цикл событий:
+    новые значения копятся в буфере и пачкой сохраняются в отдельном
+    потоке. Для источников, чьи значения не являются
+    JSON, в codecs передаётся пара (encode, decode) для записи на диск.
+    """
+
+    def __init__(self, ttls, max_entries=2000, disk_path=None, codecs=None):
+        self.ttls = dict(ttls)
+        self.codecs = dict(codecs or {})
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_task = None
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, source, key, allow_stale=False):
+        """
+        Возвращает закэшированное значение или None, если его нет или оно устарело.
+        С allow_stale=True отдаёт и просроченное значение - на случай, когда
+        свежие данные получить нельзя.
+        """
+        cache_key = (source, key)
+        now = time.time()
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at >= now or allow_stale:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return value
+            # Просроченную запись не удаляем: она ещё может понадобиться с allow_stale
+
+        entry = self._disk_get(source, key, now, allow_stale)
+        if entry is not None:
+            self._store(cache_key, entry)
+            self.disk_hits += 1
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return None
+
+    def set(self, source, key, value):
+        """
+        Сохраняет значение с временем жизни, заданным для источника.
+        """
+        ttl = self.ttls.get(source)
+        if not ttl or value is None:
+            return
+        expires_at = time.time() + ttl
+        self._store((source, key), (expires_at, value))
+        self._disk_set(source, key, expires_at, value)
+
+    def load(self, source, keys):
+        """
+        Переносит записи источника с диска в память, включая просроченные.
+        Возвращает число загруженных записей.
+        """
+        loaded = 0
+        for key in keys:
+            if (source, key) in self._entries:
+                continue
+            entry = self._disk_get(source, key, time.time(), allow_stale=True)
+            if entry is not None:
+                self._store((source, key), entry)
+                loaded += 1
+        return loaded
+
+    def expires_at(self, source, key):
+        """
+        Возвращает время истечения записи в памяти или None, если её там нет.
+        """
+        entry = self._entries.get((source, key))
+        return entry[0] if entry is not None else None
+
+    def stats(self):
+        """
+        Возвращает счётчики попаданий, промахов и вытеснений.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _store(self, cache_key, entry):
+        self._entries[cache_key] = entry
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.disk_path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " source TEXT NOT NULL, key TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, payload TEXT NOT NULL,"
+                " PRIMARY KEY (source, key))"
+            )
+            # Просроченные записи держим ещё сутки - они пригодятся при исчерпании квоты
+            with self._db:
+                self._db.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time() - 86400,))
+        return self._db
+
+    def _disk_get(self, source, key, now, allow_stale=False):
+        if not self.disk_path:
+            return None
+        # Значение могло быть вытеснено из памяти, ещё не дойдя до диска
+        with self._pending_lock:
+            entry = self._pending.get((source, key))
+        if entry is not None:
+            return entry if entry[0] >= now or allow_stale else None
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT expires_at, payload FROM response_cache WHERE source = ? AND key = ?",
+                    (source, str(key)),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Ошибка чтения дискового кэша: %s", e)
+            return None
+        if row is None or (row[0] < now and not allow_stale):
+            return None
+        value = json.loads(row[1])
+        codec = self.codecs.get(source)
+        return row[0], codec[1](value) if codec else value
+
+    def _disk_set(self, source, key, expires_at, value):
+        if not self.disk_path or self._closed:
+            return
+        with self._pending_lock:
+            self._pending[(source, key)] = (expires_at, value)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий блокировать нечего - пишем сразу
+            self.flush()
+            return
+        self._flush_task = loop.create_task(self._flush_in_background())
+
+    async def _flush_in_background(self):
+        # Значения, добавленные во время записи, уходят следующей пачкой
+        while self._pending and not self._closed:
+            await asyncio.to_thread(self.flush)
+
+    def flush(self):
+        """
+        Записывает накопленные значения на диск одной транзакцией.
+        """
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+        if not batch or self._closed:
+            return
+        rows = []
+        for (source, key), (expires_at, value) in batch.items():
+            codec = self.codecs.get(source)
+            if codec:
+                value = codec[0](value)
+            rows.append((source, str(key), expires_at, json.dumps(value, ensure_ascii=False)))
+        try:
+            with self._lock:
+                db = self._connect()
+                with db:
+                    db.executemany("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logger.warning("Ошибка записи дискового кэша: %s", e)
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,183 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+logger = logging.getLogger(__name__)
+
+
+# --- Кэш разрешения названий городов ---
+
+_SPACES_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,;:!?\"'«»()[]"
+
+
+def normalize_city_name(text: str) -> str:
+    """
+    Приводит введённое название города к каноническому ключу кэша:
+    "Киев", "киев " и "КИЕВ" дают один и тот же ключ.
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _SPACES_RE.sub(" ", text).strip(_EDGE_PUNCTUATION)
+    return text.casefold().replace("ё", "е")
+
+
+def location_from_weather(current_data):
+    """
+    Извлекает координаты и идентификатор города из ответа /weather.
+    """
+    return {
+        'id': current_data.get('id') or None,
+        'name': current_data.get('name', ''),
+        'country': current_data.get('sys', {}).get('country', ''),
+        'lat': current_data['coord']['lat'],
+        'lon': current_data['coord']['lon'],
+        'timezone': current_data.get('timezone', 0),
+    }
+
+
+class CityCache:
+    """
+    Постоянный кэш соответствия "введённое название -> город" в SQLite.
+
+    Найденные города хранятся долго, ненайденные - короткое время, чтобы
+    повторяющиеся опечатки и спам не расходовали квоту API. Поверх базы
+    держится словарь в памяти, поэтому повторные обращения не трогают диск.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, negative_ttl=600, max_memory_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_memory_entries = max_memory_entries
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS city_cache ("
+                " query TEXT PRIMARY KEY,"
+                " city_id INTEGER, name TEXT, country TEXT,"
+                " lat REAL, lon REAL, timezone INTEGER,"
+                " found INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+        return self._db
+
+    def lookup(self, text):
+        """
+        Ищет город в кэше. Возвращает (есть_в_кэше, location), где location
+        равен None для закэшированного "город не найден".
+        """
+        key = normalize_city_name(text)
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is None:
+            try:
+                with self._lock:
+                    row = self._connect().execute(
+                        "SELECT city_id, name, country, lat, lon, timezone, found, expires_at"
+                        " FROM city_cache WHERE query = ?", (key,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                # Ошибка базы (например, блокировка другим воркером) - считаем промахом
+                logger.warning("Ошибка чтения кэша городов: %s", e)
+                return False, None
+            if row is None:
+                return False, None
+            location = None
+            if row[6]:
+                location = {
+                    'id': row[0], 'name': row[1], 'country': row[2],
+                    'lat': row[3], 'lon': row[4], 'timezone': row[5],
+                }
+            entry = (location, row[7])
+            self._store_in_memory(key, entry)
+
+        location, expires_at = entry
+        if expires_at < now:
+            self._memory.pop(key, None)
+            return False, None
+        return True, location
+
+    def remember(self, text, location):
+        """
+        Сохраняет найденный город под введённым названием, а под его
+        каноническим именем из ответа API - только если такого ключа в кэше
+        ещё нет и запрос не уточнён страной. Иначе запрос вроде "Odessa,US"
+        подменил бы город для всех последующих запросов "Odessa".
+        """
+        expires_at = time.time() + self.ttl
+        keys = {normalize_city_name(text)}
+        canonical = normalize_city_name(location['name'])
+        if canonical not in keys and "," not in text and not self.lookup(canonical)[0]:
+            keys.add(canonical)
+        keys.discard("")
+        rows = [
+            (key, location['id'], location['name'], location['country'],
+             location['lat'], location['lon'], location['timezone'], 1, expires_at)
+            for key in keys
+        ]
+        for key in keys:
+            self._store_in_memory(key, (location, expires_at))
+        self._write(rows)
+
+    def remember_not_found(self, text):
+        """
+        Запоминает, что город не найден, на короткое время.
+        """
+        key = normalize_city_name(text)
+        expires_at = time.time() + self.negative_ttl
+        self._store_in_memory(key, (None, expires_at))
+        self._write([(key, None, None, None, None, None, None, 0, expires_at)])
+
+    def preload(self, limit=1000):
+        """
+        Загружает в память до limit последних найденных городов, чтобы первые
+        запросы после перезапуска не обращались к диску. Возвращает их число.
+        """
+        try:
+            with self._lock:
+                rows = self._connect().execute(
+                    "SELECT query, city_id, name, country, lat, lon, timezone, expires_at FROM city_cache"
+                    " WHERE found = 1 AND expires_at > ? ORDER BY expires_at DESC LIMIT ?",
+                    (time.time(), min(limit, self.max_memory_entries)),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Ошибка чтения кэша городов: %s", e)
+            return 0
+        # Самые свежие записи добавляются последними и вытесняются позже всех
+        for key, city_id, name, country, lat, lon, timezone, expires_at in reversed(rows):
+            location = {'id': city_id, 'name': name, 'country': country, 'lat': lat, 'lon': lon, 'timezone': timezone}
+            self._store_in_memory(key, (location, expires_at))
+        return len(rows)
+
+    def _store_in_memory(self, key, entry):
+        # Ограничиваем размер словаря, вытесняя самые старые записи
+        self._memory.pop(key, None)
+        if len(self._memory) >= self.max_memory_entries:
+            del self._memory[next(iter(self._memory))]
+        self._memory[key] = entry
+
+    def _write(self, rows):
+        # Запись в базу не обязательна: город уже сохранён в памяти
+        try:
+            with self._lock:
+                db = self._connect()
+                with db:
+                    db.executemany("INSERT OR REPLACE INTO city_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logger.warning("Ошибка записи кэша городов: %s", e)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
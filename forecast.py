@@ -0,0 +1,177 @@
+from array import array
+from datetime import date
+
+
+# Порядковый номер 1970-01-01: номер местного дня = (dt + timezone) // 86400
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+# --- Компактное представление 5-дневного прогноза ---
+
+class DailySummary:
+    """Сводка прогноза за один местный день."""
+
+    __slots__ = ("date", "temp_min", "temp_max", "condition_id", "description")
+
+    def __init__(self, day, temp_min, temp_max, condition_id, description):
+        self.date = day
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self.condition_id = condition_id
+        self.description = description
+
+
+class CompactForecast:
+    """
+    Прогноз /forecast в виде столбцов-массивов вместо списка словарей.
+
+    Каждый трёхчасовой интервал занимает несколько байт в массивах dt,
+    temp, temp_min, temp_max и condition; описания погоды хранятся один раз
+    в таблице descriptions, а интервалы ссылаются на них по номеру.
+    Местные дни считаются по целому dt со смещением timezone города, без
+    разбора строк dt_txt.
+    """
+
+    __slots__ = (
+        "city_id", "name", "country", "lat", "lon", "timezone",
+        "dt", "temp", "temp_min", "temp_max", "condition", "description_index", "descriptions",
+    )
+
+    def __init__(self, city, timezone, dt, temp, temp_min, temp_max, condition, description_index, descriptions):
+        self.city_id = city.get('id') or None
+        self.name = city.get('name', '')
+        self.country = city.get('country', '')
+        coord = city.get('coord') or {}
+        self.lat = coord.get('lat')
+        self.lon = coord.get('lon')
+        self.timezone = timezone
+        self.dt = dt
+        self.temp = temp
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self.condition = condition
+        self.description_index = description_index
+        self.descriptions = descriptions
+
+    @classmethod
+    def from_payload(cls, data):
+        """
+        Строит компактный прогноз из ответа /forecast OpenWeatherMap.
+        """
+        city = data.get('city') or {}
+        dt, temp, temp_min, temp_max = array('q'), array('f'), array('f'), array('f')
+        condition, description_index = array('H'), array('B')
+        descriptions = []
+        known = {}
+        for item in data.get('list', []):
+            main = item['main']
+            weather = item['weather'][0] if item.get('weather') else {}
+            description = weather.get('description', '')
+            index = known.get(description)
+            if index is None:
+                index = known[description] = len(descriptions)
+                descriptions.append(description)
+            dt.append(item['dt'])
+            temp.append(main['temp'])
+            temp_min.append(main.get('temp_min', main['temp']))
+            temp_max.append(main.get('temp_max', main['temp']))
+            condition.append(weather.get('id', 0))
+            description_index.append(index)
+        return cls(city, city.get('timezone') or 0, dt, temp, temp_min, temp_max,
+                   condition, description_index, tuple(descriptions))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Восстанавливает прогноз из to_dict(). Исходный ответ API тоже принимается,
+        поэтому записи дискового кэша старого формата остаются читаемыми.
+        """
+        if 'list' in data:
+            return cls.from_payload(data)
+        return cls(
+            data['city'], data['timezone'],
+            array('q', data['dt']), array('f', data['temp']),
+            array('f', data['temp_min']), array('f', data['temp_max']),
+            array('H', data['condition']), array('B', data['description_index']),
+            tuple(data['descriptions']),
+        )
+
+    def to_dict(self):
+        """
+        Возвращает столбцы прогноза в виде, пригодном для JSON.
+        """
+        return {
+            'city': {'id': self.city_id, 'name': self.name, 'country': self.country,
+                     'coord': {'lat': self.lat, 'lon': self.lon}},
+            'timezone': self.timezone,
+            'dt': self.dt.tolist(),
+            'temp': [round(value, 2) for value in self.temp],
+            'temp_min': [round(value, 2) for value in self.temp_min],
+            'temp_max': [round(value, 2) for value in self.temp_max],
+            'condition': self.condition.tolist(),
+            'description_index': self.description_index.tolist(),
+            'descriptions': list(self.descriptions),
+        }
+
+    def __len__(self):
+        return len(self.dt)
+
+    @property
+    def first_dt(self):
+        return self.dt[0] if self.dt else None
+
+    def location(self):
+        """
+        Возвращает место прогноза в формате кэша городов или None без координат.
+        """
+        if self.lat is None or self.lon is None:
+            return None
+        return {'id': self.city_id, 'lat': self.lat, 'lon': self.lon}
+
+    def temp_range(self, slots=8):
+        """
+        Возвращает (мин, макс) температуры за ближайшие slots интервалов или None.
+        """
+        if not self.dt:
+            return None
+        return min(self.temp_min[:slots]), max(self.temp_max[:slots])
+
+    def daily(self, days=3):
+        """
+        Возвращает сводки по первым days местным дням за один проход:
+        минимум и максимум температуры за день и преобладающее состояние
+        погоды (самое частое за день, при равенстве - встретившееся раньше).
+        """
+        summaries = []
+        current_day = None
+        low = high = 0.0
+        counts = {}
+        first_seen = {}
+
+        def close_day():
+            best = max(counts, key=lambda index: (counts[index], -first_seen[index]))
+            summaries.append(DailySummary(
+                date.fromordinal(_EPOCH_ORDINAL + current_day), low, high,
+                self.condition[first_seen[best]], self.descriptions[best],
+            ))
+
+        for i, dt in enumerate(self.dt):
+            day = (dt + self.timezone) // 86400
+            if day != current_day:
+                if current_day is not None:
+                    close_day()
+                    if len(summaries) >= days:
+                        return summaries
+                current_day = day
+                low, high = self.temp_min[i], self.temp_max[i]
+                counts.clear()
+                first_seen.clear()
+            else:
+                low = min(low, self.temp_min[i])
+                high = max(high, self.temp_max[i])
+            index = self.description_index[i]
+            counts[index] = counts.get(index, 0) + 1
+            first_seen.setdefault(index, i)
+        if current_day is not None:
+            close_day()
+        return summaries
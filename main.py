@@ -1,108 +1,525 @@
+import time
+# Отсчёт времени запуска начинается до импорта тяжёлых зависимостей
+_process_started = time.perf_counter()
+
 import os
-import requests
 import aiohttp
 import asyncio
+import json
+import logging
 import re
 from datetime import datetime, timedelta
+from cache import FrequencyTracker, ResponseCache, SingleFlight
+from cities import CityCache, location_from_weather, normalize_city_name
+from forecast import CompactForecast
+from ratelimit import KeyedRateLimiter, QuotaBudget, QuotaExceeded
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged
+import metrics
+from subscriptions import BroadcastSender, SubscriptionStore, parse_subscribe_args
 from telegram import Update
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
+logger = logging.getLogger("weather")
+
 TELEGRAM_BOT_TOKEN = os.getenv("BOT_TOKEN")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 AIR_QUALITY_API_KEY = os.getenv("AIR_QUALITY_API_KEY")  # OpenWeatherMap Air Quality API
 SOLAR_API_KEY = os.getenv("SOLAR_API_KEY")  # NASA Solar Flare API (бесплатный)
 
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес бота, например https://example.com
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_URL else "polling").lower()
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Секретный токен для проверки запросов от Telegram
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))  # Число процессов, делящих один порт
+
+# Журнал и метрики
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_RATE_PER_MINUTE = float(os.getenv("LOG_RATE_PER_MINUTE", "30"))  # Одинаковых сообщений в минуту
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 0 отключает отдельный сервер метрик
+
+# Параметры HTTP-клиента для запросов к внешним API
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))  # Общий таймаут запроса, секунды
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))  # Таймаут установки соединения
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))  # Всего соединений в пуле
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))  # Соединений на один хост
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))  # Время жизни keep-alive
+
+# Автоматический выключатель для каждого внешнего источника
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # Неудач подряд до размыкания
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # Пауза до пробного вызова, секунды
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "5"))  # Вызов дольше этого считается неудачей
+
+# Подстраховочный повтор запроса текущей погоды: задержка равна p95 задержек
+# источника, ограниченному этими пределами (секунды)
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.2"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "3"))
+
+# Базовые адреса внешних API (переопределяются для бенчмарков с локальной заглушкой)
+OWM_BASE_URL = os.getenv("OWM_BASE_URL", "http://api.openweathermap.org").rstrip("/")
+NOAA_BASE_URL = os.getenv("NOAA_BASE_URL", "https://services.swpc.noaa.gov").rstrip("/")
+
+OWM_CURRENT_URL = f"{OWM_BASE_URL}/data/2.5/weather"
+OWM_FORECAST_URL = f"{OWM_BASE_URL}/data/2.5/forecast"
+OWM_AIR_POLLUTION_URL = f"{OWM_BASE_URL}/data/2.5/air_pollution"
+OWM_GROUP_URL = f"{OWM_BASE_URL}/data/2.5/group"
+NOAA_XRAY_URL = f"{NOAA_BASE_URL}/json/goes/primary/xray-1-day.json"
+NOAA_KP_URL = f"{NOAA_BASE_URL}/json/planetary_k_index_1m.json"
+
+# Ошибки обращения к внешним API, после которых запрос считается неудачным
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, QuotaExceeded, CircuitOpenError)
+
+# Точность округления координат для ключа данных о загрязнении воздуха (~1 км)
+AIR_COORD_PRECISION = 2
+
+# Предельное время ожидания каждого источника (секунды от момента запуска запроса).
+# Необязательный источник, не уложившийся в срок, просто не попадает в ответ.
+SOURCE_DEADLINES = {
+    "forecast": float(os.getenv("FORECAST_DEADLINE", "6")),
+    "air": float(os.getenv("AIR_DEADLINE", "3")),
+}
+
+# Запрос погоды сразу для нескольких городов ("Киев, Львов, Одесса")
+MULTI_CITY_LIMIT = int(os.getenv("MULTI_CITY_LIMIT", "30"))  # Больше городов в одном сообщении не обрабатываем
+MULTI_CITY_CONCURRENCY = int(os.getenv("MULTI_CITY_CONCURRENCY", "5"))  # Одновременных запросов прогноза
+OWM_GROUP_SIZE = 20  # Максимум id в одном запросе /group
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Ежедневные подписки на прогноз и их рассылка
+SUBSCRIPTIONS_PATH = os.getenv("SUBSCRIPTIONS_PATH", "subscriptions.sqlite3")
+SUBSCRIPTIONS_PER_CHAT = int(os.getenv("SUBSCRIPTIONS_PER_CHAT", "5"))
+SUBSCRIPTION_TICK = float(os.getenv("SUBSCRIPTION_TICK", "10"))  # Период проверки подписок, секунды
+SUBSCRIPTION_MAX_DELAY = float(os.getenv("SUBSCRIPTION_MAX_DELAY", "3600"))  # Опоздавшие сильнее не отправляются
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # Сообщений в секунду на всю рассылку (лимит Telegram ~30)
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))  # Сообщений в секунду в один чат
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "30"))  # Одновременных отправок при рассылке
+
+# Постоянный кэш разрешения названий городов (переживает перезапуски)
+CITY_CACHE_PATH = os.getenv("CITY_CACHE_PATH", "weather_cache.sqlite3")
+CITY_CACHE_TTL = float(os.getenv("CITY_CACHE_TTL", str(30 * 24 * 3600)))  # Найденные города, секунды
+CITY_NOT_FOUND_TTL = float(os.getenv("CITY_NOT_FOUND_TTL", "600"))  # "Город не найден", секунды
+
+CITY_NOT_FOUND_MESSAGE = "Город не найден. Пожалуйста, проверьте название города."
+
+# Единицы измерения и язык ответов OpenWeatherMap (входят в ключ кэша)
+WEATHER_UNITS = "metric"  # Метрические единицы (Цельсий)
+WEATHER_LANG = "ru"       # Русский язык
+
+# Кэш ответов: время жизни по источникам, размер и необязательный дисковый уровень
+RESPONSE_CACHE_TTLS = {
+    "current": float(os.getenv("CURRENT_CACHE_TTL", "600")),
+    "forecast": float(os.getenv("FORECAST_CACHE_TTL", "1800")),
+    "air": float(os.getenv("AIR_CACHE_TTL", "1800")),
+}
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", CITY_CACHE_PATH)  # Пустое значение отключает диск
+
+# Снимок состояния для быстрого холодного старта: популярные места и космическая погода
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "weather_snapshot.json")  # Пустое значение отключает снимок
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "300"))  # Период сохранения, секунды
+SNAPSHOT_HOT_LOCATIONS = int(os.getenv("SNAPSHOT_HOT_LOCATIONS", "100"))  # Сколько популярных мест сохранять
+CITY_PRELOAD = int(os.getenv("CITY_PRELOAD", "1000"))  # Сколько разрешённых городов загрузить в память при старте
+
+# Прогрев кэша: данные самых популярных мест обновляются в фоне до истечения TTL
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", "20"))  # Сколько популярных мест держать тёплыми, 0 отключает прогрев
+WARM_INTERVAL = float(os.getenv("WARM_INTERVAL", "60"))  # Период проверки, секунды
+WARM_LEAD = float(os.getenv("WARM_LEAD", "120"))  # За сколько секунд до истечения обновлять запись
+WARM_MAX_PER_TICK = int(os.getenv("WARM_MAX_PER_TICK", "10"))  # Не больше вызовов API за одну проверку
+WARM_MIN_BUDGET = float(os.getenv("WARM_MIN_BUDGET", "0.5"))  # Прогрев идёт, только пока осталось столько бюджета
+WARM_MIN_HITS = float(os.getenv("WARM_MIN_HITS", "2"))  # Минимум обращений (с затуханием), чтобы место считалось популярным
+WARM_HALF_LIFE = float(os.getenv("WARM_HALF_LIFE", "3600"))  # Период полураспада счётчика обращений, секунды
+
+# Лимиты: частота запросов одного чата и общий бюджет вызовов OpenWeatherMap
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "6"))
+USER_RATE_BURST = int(os.getenv("USER_RATE_BURST", "3"))
+OWM_CALLS_PER_MINUTE = int(os.getenv("OWM_CALLS_PER_MINUTE", "60"))
+OWM_CALLS_PER_DAY = int(os.getenv("OWM_CALLS_PER_DAY", "30000"))
+# Ниже этой доли бюджета необязательные источники берутся только из кэша
+OWM_BUDGET_LOW_WATERMARK = float(os.getenv("OWM_BUDGET_LOW_WATERMARK", "0.2"))
+
+QUOTA_EXCEEDED_MESSAGE = "Сервис погоды сейчас перегружен. Пожалуйста, попробуйте позже."
+USER_RATE_LIMITED_MESSAGE = "Слишком много запросов. Подождите немного и попробуйте снова."
+
+# Глобальные данные NOAA о космической погоде одинаковы для всех пользователей,
+# поэтому хранятся в одном снимке и обновляются в фоне через job queue.
+SPACE_WEATHER_REFRESH_INTERVAL = float(os.getenv("SPACE_WEATHER_REFRESH_INTERVAL", "60"))  # Период обновления, секунды
+SPACE_WEATHER_MAX_AGE = float(os.getenv("SPACE_WEATHER_MAX_AGE", "900"))  # Старше этого снимок не показываем
+
+# Общая сессия aiohttp, открывается и закрывается вместе с Application
+_http_session = None
+
+# Выключатели и недавние задержки по источникам, создаются при первом обращении
+_circuit_breakers = {}
+_upstream_latencies = {}
+
+# Последний снимок космической погоды и фоновая задача его обновления
+_space_weather = {'data': None, 'fetched_at': 0.0}
+_space_weather_refresh_task = None
+
+# Одновременные запросы air_pollution по одним координатам объединяются в один
+_air_pollution_flight = SingleFlight()
+
+city_cache = CityCache(CITY_CACHE_PATH, ttl=CITY_CACHE_TTL, negative_ttl=CITY_NOT_FOUND_TTL)
+# Прогнозы хранятся в компактном столбцовом виде, а не исходным JSON
+response_cache = ResponseCache(
+    RESPONSE_CACHE_TTLS,
+    max_entries=RESPONSE_CACHE_SIZE,
+    disk_path=RESPONSE_CACHE_PATH or None,
+    codecs={"forecast": (CompactForecast.to_dict, CompactForecast.from_dict)},
+)
+# Частота обращений к разрешённым местам - по ней выбираются места для прогрева
+location_tracker = FrequencyTracker(max_keys=RESPONSE_CACHE_SIZE, half_life=WARM_HALF_LIFE)
+# Отрисованные ответы дёшево пересчитать, поэтому они хранятся только в памяти
+reply_cache = ResponseCache({"reply": RESPONSE_CACHE_TTLS["current"]}, max_entries=RESPONSE_CACHE_SIZE)
+
+subscription_store = SubscriptionStore(SUBSCRIPTIONS_PATH, max_per_chat=SUBSCRIPTIONS_PER_CHAT)
+broadcast_sender = BroadcastSender(BROADCAST_RATE, BROADCAST_PER_CHAT_RATE)
+_subscription_tick_running = False
+
+# Лимиты хранятся в памяти процесса, поэтому в режиме webhook с несколькими
+# воркерами каждый получает свою долю: иначе общий бюджет и лимит чата
+# умножились бы на число процессов
+_LIMIT_SHARE = WEB_WORKERS if BOT_MODE == "webhook" and WEB_WORKERS > 1 else 1
+
+user_rate_limiter = KeyedRateLimiter(
+    USER_RATE_PER_MINUTE / 60.0 / _LIMIT_SHARE, max(1.0, USER_RATE_BURST / _LIMIT_SHARE))
+owm_budget = QuotaBudget(
+    OWM_CALLS_PER_MINUTE / _LIMIT_SHARE, OWM_CALLS_PER_DAY / _LIMIT_SHARE, low_watermark=OWM_BUDGET_LOW_WATERMARK)
+
+
+# --- HTTP-клиент ---
+
+async def open_http_session(application=None) -> None:
+    """
+    Создаёт общую сессию aiohttp с пулом keep-alive соединений.
+    Используется как post_init хук Application.
+    """
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        return
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT)
+    _http_session = aiohttp.ClientSession(connector=connector, timeout=timeout, raise_for_status=True)
+
+async def close_http_session(application=None) -> None:
+    """
+    Закрывает общую сессию aiohttp.
+    Используется как post_shutdown хук Application.
+    """
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую сессию, при необходимости создавая её.
+    """
+    if _http_session is None or _http_session.closed:
+        await open_http_session()
+    return _http_session
+
+def get_circuit_breaker(source) -> CircuitBreaker:
+    """
+    Возвращает автоматический выключатель источника, создавая его при необходимости.
+    """
+    breaker = _circuit_breakers.get(source)
+    if breaker is None:
+        breaker = _circuit_breakers[source] = CircuitBreaker(
+            source,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_TIMEOUT,
+            slow_call_threshold=BREAKER_SLOW_CALL,
+        )
+    return breaker
+
+def get_latency_tracker(source) -> LatencyTracker:
+    """
+    Возвращает окно последних задержек источника.
+    """
+    tracker = _upstream_latencies.get(source)
+    if tracker is None:
+        tracker = _upstream_latencies[source] = LatencyTracker()
+    return tracker
+
+def is_upstream_failure(error) -> bool:
+    """
+    Отличает сбой сервиса от ответа по существу: 404 "город не найден"
+    не должен размыкать выключатель, а 5xx, 429 и сетевые ошибки - должны.
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return True
+
+async def fetch_json(url, params=None, timeout=None, source="other"):
+    """
+    Выполняет GET-запрос через общую сессию и возвращает JSON.
+    Пока выключатель источника разомкнут, сразу выбрасывает CircuitOpenError.
+    Задержка и ошибки учитываются в метриках источника source.
+    Исключения aiohttp пробрасываются вызывающему коду.
+    """
+    breaker = get_circuit_breaker(source)
+    if not breaker.allow():
+        metrics.UPSTREAM_ERRORS.inc(source, CircuitOpenError.__name__)
+        raise CircuitOpenError(f"Источник '{source}' временно отключён")
+
+    session = await get_http_session()
+    request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+    started = time.perf_counter()
+    try:
+        async with session.get(url, params=params, timeout=request_timeout) as response:
+            data = await response.json(content_type=None)
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(source, type(e).__name__)
+        if is_upstream_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success(time.perf_counter() - started)
+        raise
+    finally:
+        metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - started, source)
+
+    elapsed = time.perf_counter() - started
+    breaker.record_success(elapsed)
+    get_latency_tracker(source).observe(elapsed)
+    return data
+
 
 # --- Функции для работы с различными API ---
 
+async def cancel_tasks(*tasks) -> None:
+    """
+    Отменяет задачи и дожидается их завершения, подавляя их исключения.
+    """
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# Пары замены специальных символов Telegram Markdown V2, строятся один раз.
+# На тексте с эмодзи цепочка str.replace быстрее и str.translate, и re.sub (см. bench/micro.py)
+_MARKDOWN_ESCAPES = tuple((char, '\\' + char) for char in r'_*[]()~`>#+-=|{}.!')
+
 def escape_markdown(text: str) -> str:
     """
     Экранирует все специальные символы для Telegram Markdown V2.
     """
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text)
+    for char, escaped in _MARKDOWN_ESCAPES:
+        if char in text:
+            text = text.replace(char, escaped)
+    return text
 
-def get_weather_data(city_name, api_key):
+def describe_weather_error(error) -> str:
     """
-    Получает данные о текущей погоде и 5-дневный прогноз для указанного города.
+    Преобразует исключение при запросе к OpenWeatherMap в сообщение для пользователя.
     """
-    base_url_current = "http://api.openweathermap.org/data/2.5/weather?"
-    base_url_forecast = "http://api.openweathermap.org/data/2.5/forecast?"
+    if isinstance(error, aiohttp.ClientResponseError):
+        if error.status == 404:
+            return CITY_NOT_FOUND_MESSAGE
+        return f"Ошибка HTTP: {error.status} {error.message}"
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return f"Ошибка подключения: {error}. Проверьте ваше интернет-соединение."
+    if isinstance(error, asyncio.TimeoutError):
+        return "Превышено время ожидания ответа от сервера погоды."
+    if isinstance(error, QuotaExceeded):
+        return QUOTA_EXCEEDED_MESSAGE
+    if isinstance(error, CircuitOpenError):
+        return "Сервис погоды временно недоступен. Пожалуйста, попробуйте через минуту."
+    if isinstance(error, ValueError):
+        return "Сервер погоды вернул некорректный ответ. Пожалуйста, попробуйте позже."
+    return f"Произошла непредвиденная ошибка: {error}."
 
-    params_current = {
-        "q": city_name,
-        "appid": api_key,
-        "units": "metric",  # Метрические единицы (Цельсий)
-        "lang": "ru"        # Русский язык
-    }
+def location_params(location):
+    """
+    Возвращает параметры запроса OpenWeatherMap для места: по id или
+    координатам для уже разрешённого города, иначе по названию.
+    """
+    if isinstance(location, str):
+        return {"q": location}
+    if location.get('id'):
+        return {"id": location['id']}
+    return {"lat": location['lat'], "lon": location['lon']}
 
-    params_forecast = {
-        "q": city_name,
-        "appid": api_key,
-        "units": "metric",  # Метрические единицы (Цельсий)
-        "lang": "ru"        # Русский язык
-    }
+def resolve_city(city_name):
+    """
+    Разрешает название города через локальный кэш.
+    Возвращает (есть_в_кэше, location); location равен None, если город
+    недавно не был найден.
+    """
+    return city_cache.lookup(city_name)
+
+def remember_city_result(city_name, current_weather=None, error=None):
+    """
+    Сохраняет результат разрешения названия: найденный город или 404.
+    """
+    if current_weather:
+        city_cache.remember(city_name, location_from_weather(current_weather))
+    elif isinstance(error, aiohttp.ClientResponseError) and error.status == 404:
+        city_cache.remember_not_found(city_name)
+
+def location_cache_key(location):
+    """
+    Возвращает ключ кэша ответов для разрешённого места с учётом единиц и языка.
+    """
+    if location.get('id'):
+        place = f"id:{location['id']}"
+    else:
+        place = f"{location['lat']:.2f},{location['lon']:.2f}"
+    return f"{place}|{WEATHER_UNITS}|{WEATHER_LANG}"
+
+async def fetch_owm_json(url, params, source):
+    """
+    Выполняет запрос к OpenWeatherMap, списывая вызов из общего бюджета.
+    Если бюджет исчерпан, выбрасывает QuotaExceeded без обращения к сети.
+    """
+    if not owm_budget.try_spend():
+        raise QuotaExceeded("Бюджет вызовов OpenWeatherMap исчерпан")
+    return await fetch_json(url, params=params, source=source)
+
+def hedge_delay(source) -> float:
+    """
+    Возвращает задержку перед подстраховочным запросом: p95 недавних задержек источника.
+    """
+    p95 = get_latency_tracker(source).percentile(0.95, default=HEDGE_MAX_DELAY)
+    return min(max(p95, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+async def fetch_owm_cached(source, key, url, params, cache_only=False, flight=None, hedge=False, parse=None,
+                           refresh=False):
+    """
+    Возвращает ответ OpenWeatherMap из кэша или из сети.
 
-    current_weather_data = None
-    forecast_data = None
+    key=None означает, что место ещё не разрешено и кэш не проверяется.
+    С cache_only=True сеть не используется. Если свежих данных нет, а бюджет
+    исчерпан, источник отключён выключателем или запрошен только кэш,
+    отдаётся устаревшая запись при наличии. С hedge=True медленный запрос
+    подстраховывается вторым, если бюджет вызовов это позволяет.
+    parse преобразует ответ сети перед сохранением в кэш. С refresh=True
+    свежая запись кэша игнорируется и данные запрашиваются заново.
+    """
+    if key is not None and not refresh:
+        data = response_cache.get(source, key)
+        if data is not None:
+            return data
+    if cache_only:
+        return response_cache.get(source, key, allow_stale=True) if key is not None else None
+
+    async def fetch_and_store():
+        # Разбор и запись в кэш выполняются внутри общего запроса single-flight:
+        # ответ, пришедший после ухода всех ожидающих по таймауту, всё равно
+        # попадает в кэш, и оплаченный вызов не пропадает
+        if hedge and not owm_budget.is_low():
+            data = await hedged(lambda: fetch_owm_json(url, params, source), hedge_delay(source))
+        else:
+            data = await fetch_owm_json(url, params, source)
+        if parse is not None:
+            data = parse(data)
+        if key is not None:
+            response_cache.set(source, key, data)
+        return data
 
     try:
-        response_current = requests.get(base_url_current, params=params_current)
-        response_current.raise_for_status()
-        current_weather_data = response_current.json()
+        if flight is not None:
+            return await flight.run(key, fetch_and_store)
+        return await fetch_and_store()
+    except (QuotaExceeded, CircuitOpenError):
+        stale = response_cache.get(source, key, allow_stale=True) if key is not None else None
+        if stale is None:
+            raise
+        return stale
+
+async def get_current_weather(location, api_key, refresh=False):
+    """
+    Получает данные о текущей погоде для названия города или разрешённого места.
+    Для разрешённого места сначала проверяется кэш ответов, если не задан refresh.
+    Ошибки запроса пробрасываются.
+    """
+    params = {
+        **location_params(location),
+        "appid": api_key,
+        "units": WEATHER_UNITS,
+        "lang": WEATHER_LANG
+    }
+    if not isinstance(location, str):
+        return await fetch_owm_cached("current", location_cache_key(location), OWM_CURRENT_URL, params,
+                                      hedge=not refresh, refresh=refresh)
 
-        response_forecast = requests.get(base_url_forecast, params=params_forecast)
-        response_forecast.raise_for_status()
-        forecast_data = response_forecast.json()
+    data = await fetch_owm_cached("current", None, OWM_CURRENT_URL, params, hedge=True)
+    response_cache.set("current", location_cache_key(location_from_weather(data)), data)
+    return data
 
-    except requests.exceptions.HTTPError as http_err:
-        if response_current.status_code == 404 or response_forecast.status_code == 404:
-            return None, "Город не найден. Пожалуйста, проверьте название города."
-        return None, f"Ошибка HTTP: {http_err}"
-    except requests.exceptions.ConnectionError as conn_err:
-        return None, f"Ошибка подключения: {conn_err}. Проверьте ваше интернет-соединение."
-    except requests.exceptions.Timeout as timeout_err:
-        return None, f"Превышено время ожидания: {timeout_err}."
-    except requests.exceptions.RequestException as req_err:
-        return None, f"Произошла непредвиденная ошибка: {req_err}."
+async def get_forecast(location, api_key, cache_only=False, refresh=False):
+    """
+    Получает 5-дневный прогноз с шагом 3 часа в виде CompactForecast.
+    Для разрешённого места сначала проверяется кэш ответов, если не задан refresh.
+    Ошибки запроса пробрасываются.
+    """
+    params = {
+        **location_params(location),
+        "appid": api_key,
+        "units": WEATHER_UNITS,
+        "lang": WEATHER_LANG
+    }
+    if not isinstance(location, str):
+        return await fetch_owm_cached("forecast", location_cache_key(location), OWM_FORECAST_URL, params, cache_only,
+                                      parse=CompactForecast.from_payload, refresh=refresh)
 
-    return current_weather_data, forecast_data
+    data = await fetch_owm_cached("forecast", None, OWM_FORECAST_URL, params, cache_only,
+                                  parse=CompactForecast.from_payload)
+    forecast_location = data.location() if data is not None else None
+    if forecast_location:
+        response_cache.set("forecast", location_cache_key(forecast_location), data)
+    return data
 
-def get_air_quality_data(lat, lon, api_key):
+def air_pollution_key(lat, lon):
+    """
+    Возвращает ключ координат для данных о загрязнении воздуха.
     """
-    Получает данные о качестве воздуха.
+    return round(lat, AIR_COORD_PRECISION), round(lon, AIR_COORD_PRECISION)
+
+async def get_air_pollution(lat, lon, cache_only=False, refresh=False):
     """
+    Получает данные air_pollution для координат - общий источник для
+    качества воздуха и радиационного фона. Ответ кэшируется, а одновременные
+    запросы для одних и тех же координат выполняются одним обращением к API.
+    Ошибки запроса пробрасываются.
+    """
+    api_key = AIR_QUALITY_API_KEY or OPENWEATHER_API_KEY
     if not api_key:
         return None
-    
-    base_url = "http://api.openweathermap.org/data/2.5/air_pollution"
+
+    key = air_pollution_key(lat, lon)
     params = {
-        "lat": lat,
-        "lon": lon,
+        "lat": key[0],
+        "lon": key[1],
         "appid": api_key
     }
-    
-    try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        return response.json()
-    except:
-        return None
+    return await fetch_owm_cached("air", key, OWM_AIR_POLLUTION_URL, params, cache_only,
+                                  flight=_air_pollution_flight, refresh=refresh)
 
-def get_solar_activity_data():
+async def get_solar_activity_data():
     """
     Получает данные о солнечной активности и магнитных бурях.
     """
     # Используем бесплатный API от NOAA
-    base_url = "https://services.swpc.noaa.gov/json/goes/primary/xray-1-day.json"
+    base_url = NOAA_XRAY_URL
     
     try:
-        print("Запрашиваю данные о солнечной активности...")
-        response = requests.get(base_url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        logger.debug("Запрашиваю данные о солнечной активности...")
+        data = await fetch_json(base_url, source="solar_xray")
         
-        print(f"Получено {len(data) if data else 0} записей о солнечной активности")
+        logger.debug("Получено %d записей о солнечной активности", len(data) if data else 0)
         
         # Получаем последние данные о солнечных вспышках
         if data and len(data) > 0:
@@ -112,21 +529,19 @@ def get_solar_activity_data():
                 'flare_time': latest_flare.get('time_tag', 'N/A'),
                 'intensity': latest_flare.get('flux', 'N/A')
             }
-            print(f"Данные о вспышке: {result}")
+            logger.debug("Данные о вспышке: %s", result)
             return result
         else:
-            print("Нет данных о солнечных вспышках")
+            logger.warning("Нет данных о солнечных вспышках")
     except Exception as e:
-        print(f"Ошибка при получении данных о солнечной активности: {e}")
+        logger.warning("Ошибка при получении данных о солнечной активности: %s", e)
     
     # Альтернативный источник - магнитные бури
     try:
-        print("Пробую альтернативный источник данных...")
+        logger.info("Пробую альтернативный источник данных...")
         # Используем другой API для магнитных бурь
-        geomagnetic_url = "https://services.swpc.noaa.gov/json/planetary_k_index_1m.json"
-        response = requests.get(geomagnetic_url, timeout=10)
-        response.raise_for_status()
-        geomagnetic_data = response.json()
+        geomagnetic_url = NOAA_KP_URL
+        geomagnetic_data = await fetch_json(geomagnetic_url, source="solar_kp")
         
         if geomagnetic_data and len(geomagnetic_data) > 0:
             latest_kp = geomagnetic_data[-1]
@@ -152,43 +567,551 @@ def get_solar_activity_data():
                 'intensity': f"Kp={kp_index}",
                 'storm_level': storm_level
             }
-            print(f"Данные о магнитной активности: {result}")
+            logger.debug("Данные о магнитной активности: %s", result)
             return result
     except Exception as e:
-        print(f"Ошибка при получении данных о магнитной активности: {e}")
+        logger.warning("Ошибка при получении данных о магнитной активности: %s", e)
     
     return None
 
-def get_radiation_data(lat, lon):
+def extract_radiation_data(air_pollution_data):
     """
-    Получает данные о радиационном фоне (используем OpenWeatherMap UV Index).
+    Извлекает данные о радиационном фоне из ответа air_pollution.
     """
     if not OPENWEATHER_API_KEY:
         return None
-    
-    base_url = "http://api.openweathermap.org/data/2.5/air_pollution"
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "appid": OPENWEATHER_API_KEY
-    }
-    
+
+    if air_pollution_data and 'list' in air_pollution_data and len(air_pollution_data['list']) > 0:
+        current = air_pollution_data['list'][0]
+        return {
+            'uv_index': current.get('main', {}).get('aqi', 'N/A'),
+            'components': current.get('components', {})
+        }
+    return None
+
+# --- Кэш космической погоды ---
+
+async def refresh_space_weather(context=None) -> None:
+    """
+    Загружает свежие данные о солнечной активности и обновляет общий снимок.
+    Вызывается периодически из job queue; при ошибке остаётся прежний снимок.
+    """
+    data = await get_solar_activity_data()
+    if data:
+        _space_weather['data'] = data
+        _space_weather['fetched_at'] = time.time()
+
+def _schedule_space_weather_refresh() -> None:
+    """
+    Запускает фоновое обновление снимка, если оно ещё не выполняется.
+    """
+    global _space_weather_refresh_task
+    if _space_weather_refresh_task is not None and not _space_weather_refresh_task.done():
+        return
     try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data and 'list' in data and len(data['list']) > 0:
-            current = data['list'][0]
-            return {
-                'uv_index': current.get('main', {}).get('aqi', 'N/A'),
-                'components': current.get('components', {})
-            }
-    except:
+        _space_weather_refresh_task = asyncio.get_running_loop().create_task(refresh_space_weather())
+    except RuntimeError:
+        # Нет запущенного цикла событий - обновит job queue
         pass
-    
+
+def get_space_weather_snapshot():
+    """
+    Возвращает последний снимок космической погоды без сетевых запросов.
+
+    Если снимок устарел, отдаёт его как есть и запускает фоновое обновление
+    (stale-while-revalidate). Слишком старый или отсутствующий снимок
+    не показывается пользователю.
+    """
+    data = _space_weather['data']
+    age = time.time() - _space_weather['fetched_at']
+    if data is None or age > SPACE_WEATHER_REFRESH_INTERVAL * 2:
+        _schedule_space_weather_refresh()
+    if data is None or age > SPACE_WEATHER_MAX_AGE:
+        return None
+    return data
+
+def schedule_space_weather_job(application) -> None:
+    """
+    Регистрирует периодическое обновление космической погоды в job queue.
+    """
+    if application.job_queue is None:
+        logger.warning("job queue недоступна, космическая погода будет обновляться по запросу.")
+        return
+    application.job_queue.run_repeating(
+        refresh_space_weather,
+        interval=SPACE_WEATHER_REFRESH_INTERVAL,
+        first=0,
+        name="space_weather_refresh",
+    )
+
+# --- Прогрев кэша популярных мест ---
+
+def record_location(location) -> None:
+    """
+    Учитывает обращение к разрешённому месту для выбора мест для прогрева.
+    """
+    location_tracker.record(location_cache_key(location), location)
+
+def _warm_cache_key(source, location):
+    if source == "air":
+        return air_pollution_key(location['lat'], location['lon'])
+    return location_cache_key(location)
+
+async def _warm_source(source, location):
+    if source == "current":
+        await get_current_weather(location, OPENWEATHER_API_KEY, refresh=True)
+    elif source == "forecast":
+        await get_forecast(location, OPENWEATHER_API_KEY, refresh=True)
+    else:
+        await get_air_pollution(location['lat'], location['lon'], refresh=True)
+
+async def warm_hot_locations(context=None) -> int:
+    """
+    Обновляет текущую погоду, прогноз и воздух для самых популярных мест,
+    пока записи кэша ещё не истекли, чтобы пользователи получали их из памяти.
+
+    За один проход выполняется не больше WARM_MAX_PER_TICK вызовов,
+    по одному, начиная с записей, истекающих раньше всех. Прогрев
+    останавливается, как только бюджет вызовов опускается ниже
+    WARM_MIN_BUDGET - запросы пользователей важнее.
+    Возвращает число обновлённых записей.
+    """
+    if owm_budget.remaining_ratio() < WARM_MIN_BUDGET:
+        return 0
+    sources = ("current", "forecast", "air") if AIR_QUALITY_API_KEY or OPENWEATHER_API_KEY else ("current", "forecast")
+    refresh_before = time.time() + WARM_LEAD
+    due = []
+    for _, location, hits in location_tracker.top(WARM_TOP_N):
+        if hits < WARM_MIN_HITS:
+            break
+        for source in sources:
+            expires_at = response_cache.expires_at(source, _warm_cache_key(source, location)) or 0.0
+            if expires_at < refresh_before:
+                due.append((expires_at, source, location))
+    due.sort(key=lambda item: item[0])
+
+    refreshed = 0
+    for _, source, location in due[:WARM_MAX_PER_TICK]:
+        if owm_budget.remaining_ratio() < WARM_MIN_BUDGET:
+            break
+        try:
+            await _warm_source(source, location)
+        except UPSTREAM_ERRORS as e:
+            logger.debug("Не удалось прогреть %s для %s: %s", source, location.get('name'), e)
+            continue
+        metrics.CACHE_WARM_REFRESHES.inc(source)
+        refreshed += 1
+    if refreshed:
+        logger.debug("Прогрето записей кэша: %d из %d", refreshed, len(due))
+    return refreshed
+
+def schedule_cache_warming_job(application) -> None:
+    """
+    Регистрирует периодический прогрев кэша популярных мест в job queue.
+    Прогрев ведёт только первый воркер, чтобы не тратить бюджет вызовов
+    на одни и те же места в каждом процессе.
+    """
+    if WARM_TOP_N <= 0 or _worker_index != 0:
+        return
+    if application.job_queue is None:
+        logger.warning("job queue недоступна, прогрев кэша отключён.")
+        return
+    # Первый прогрев сразу после старта освежает места, восстановленные из снимка
+    application.job_queue.run_repeating(
+        warm_hot_locations,
+        interval=WARM_INTERVAL,
+        first=0,
+        name="cache_warming",
+    )
+
+# --- Быстрый старт: снимок состояния и прогрев соединений ---
+
+def _build_startup_snapshot() -> dict:
+    return {
+        'saved_at': time.time(),
+        'space_weather': dict(_space_weather),
+        'hot_locations': [
+            {'location': location, 'hits': hits}
+            for _, location, hits in location_tracker.top(SNAPSHOT_HOT_LOCATIONS)
+        ],
+    }
+
+def _write_startup_snapshot(snapshot) -> None:
+    # У каждого воркера свой временный файл, замена итогового атомарна
+    temp_path = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(temp_path, SNAPSHOT_PATH)
+    except OSError as e:
+        logger.warning("Не удалось сохранить снимок состояния: %s", e)
+
+def save_startup_snapshot() -> None:
+    """
+    Сохраняет популярные места и последний снимок космической погоды,
+    чтобы после перезапуска не начинать с холодного кэша. Сами ответы
+    API уже лежат в дисковом кэше, в снимок попадают только их ключи.
+    """
+    if SNAPSHOT_PATH:
+        _write_startup_snapshot(_build_startup_snapshot())
+
+async def save_startup_snapshot_job(context) -> None:
+    """
+    Периодическое сохранение снимка из job queue. Снимок собирается в цикле
+    событий, а запись на диск выполняется в отдельном потоке.
+    """
+    if SNAPSHOT_PATH:
+        await asyncio.to_thread(_write_startup_snapshot, _build_startup_snapshot())
+
+def restore_startup_snapshot() -> dict:
+    """
+    Восстанавливает состояние после перезапуска: загружает в память
+    разрешённые города, счётчики популярных мест с учётом прошедшего
+    времени, их ответы из дискового кэша и снимок космической погоды.
+    Возвращает число восстановленных объектов по видам.
+    """
+    restored = {'cities': city_cache.preload(CITY_PRELOAD), 'locations': 0, 'responses': 0, 'space_weather': 0}
+    if not SNAPSHOT_PATH:
+        return restored
+    try:
+        with open(SNAPSHOT_PATH, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return restored
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось прочитать снимок состояния: %s", e)
+        return restored
+
+    space_weather = snapshot.get('space_weather') or {}
+    if space_weather.get('data') and time.time() - space_weather.get('fetched_at', 0) < SPACE_WEATHER_MAX_AGE:
+        _space_weather.update(space_weather)
+        restored['space_weather'] = 1
+
+    # Счётчики обращений затухают и за время простоя
+    decay = 0.5 ** (max(0.0, time.time() - snapshot.get('saved_at', 0)) / WARM_HALF_LIFE)
+    keys = {"current": [], "forecast": [], "air": []}
+    for item in snapshot.get('hot_locations', []):
+        location = item['location']
+        location_tracker.record(location_cache_key(location), location, count=item['hits'] * decay)
+        for source, source_keys in keys.items():
+            source_keys.append(_warm_cache_key(source, location))
+        restored['locations'] += 1
+    for source, source_keys in keys.items():
+        restored['responses'] += response_cache.load(source, source_keys)
+    return restored
+
+def schedule_snapshot_job(application) -> None:
+    """
+    Регистрирует периодическое сохранение снимка состояния в job queue.
+    Снимок пишет только первый воркер - тот, что ведёт прогрев кэша.
+    """
+    if not SNAPSHOT_PATH or _worker_index != 0 or application.job_queue is None:
+        return
+    application.job_queue.run_repeating(
+        save_startup_snapshot_job,
+        interval=SNAPSHOT_INTERVAL,
+        first=SNAPSHOT_INTERVAL,
+        name="startup_snapshot",
+    )
+
+async def prewarm_connections() -> None:
+    """
+    Заранее открывает keep-alive соединения (DNS, TCP и TLS) с внешними API,
+    чтобы первый запрос пользователя не платил за их установку.
+    Запросы HEAD к корню сервиса не расходуют бюджет вызовов.
+    """
+    session = await get_http_session()
+    timeout = aiohttp.ClientTimeout(total=HTTP_CONNECT_TIMEOUT * 2)
+
+    async def touch(url):
+        try:
+            async with session.head(url, raise_for_status=False, allow_redirects=False, timeout=timeout):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("Не удалось заранее открыть соединение с %s: %s", url, e)
+
+    await asyncio.gather(*(touch(url + "/") for url in dict.fromkeys((OWM_BASE_URL, NOAA_BASE_URL))))
+
+# --- Оркестрация запросов ---
+
+async def await_optional_source(task, deadline_at, source):
+    """
+    Ожидает необязательный источник не дольше его крайнего срока.
+    Если источник опоздал или завершился любой ошибкой, возвращает None:
+    необязательный источник никогда не должен срывать ответ.
+    """
+    remaining = deadline_at - asyncio.get_running_loop().time()
+    try:
+        return await asyncio.wait_for(task, timeout=max(remaining, 0))
+    except asyncio.TimeoutError:
+        logger.info("Источник '%s' не уложился в %s с, пропускаю", source, SOURCE_DEADLINES[source])
+    except (aiohttp.ClientError, QuotaExceeded, CircuitOpenError, ValueError) as e:
+        logger.warning("Ошибка источника '%s': %s", source, e)
+    except Exception:
+        logger.exception("Непредвиденная ошибка источника '%s'", source)
     return None
 
+async def collect_weather_report(city_name, api_key, location=None):
+    """
+    Собирает все данные для ответа пользователю с максимальным параллелизмом.
+
+    Название города сначала разрешается через локальный кэш, чтобы запросы
+    шли по id города. Текущая погода и прогноз запрашиваются одновременно, данные о солнечной
+    активности берутся из общего снимка без сетевых запросов. Как только
+    известны координаты города, запускается единственный запрос air_pollution,
+    из которого берутся и качество воздуха, и радиационный фон.
+
+    Когда бюджет вызовов OpenWeatherMap на исходе, необязательные источники
+    берутся только из кэша; когда он исчерпан, текущая погода отдаётся из
+    кэша, даже устаревшего, а без него возвращается просьба повторить позже.
+    Уже разрешённое место можно передать в location, минуя кэш городов.
+    Возвращает (report, None) при успехе или (None, сообщение_об_ошибке).
+    """
+    if location is not None:
+        cached = True
+    else:
+        cached, location = resolve_city(city_name)
+        if cached and location is None:
+            return None, CITY_NOT_FOUND_MESSAGE
+    query = location or city_name
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    economy = owm_budget.is_low()
+
+    current_task = asyncio.create_task(get_current_weather(query, api_key))
+    forecast_task = asyncio.create_task(get_forecast(query, api_key, cache_only=economy))
+    solar_data = get_space_weather_snapshot()
+
+    try:
+        current_weather = await current_task
+    except (*UPSTREAM_ERRORS, ValueError) as err:
+        await cancel_tasks(forecast_task)
+        if not cached:
+            remember_city_result(city_name, error=err)
+        return None, describe_weather_error(err)
+
+    if not cached:
+        remember_city_result(city_name, current_weather)
+    record_location(location or location_from_weather(current_weather))
+
+    # Координаты известны - запускаем зависящие от них источники
+    lat = current_weather['coord']['lat']
+    lon = current_weather['coord']['lon']
+    coord_started = loop.time()
+    air_task = asyncio.create_task(get_air_pollution(lat, lon, cache_only=economy))
+
+    forecast, air_pollution = await asyncio.gather(
+        await_optional_source(forecast_task, started + SOURCE_DEADLINES["forecast"], "forecast"),
+        await_optional_source(air_task, coord_started + SOURCE_DEADLINES["air"], "air"),
+    )
+    air_data = air_pollution if AIR_QUALITY_API_KEY else None
+    radiation_data = extract_radiation_data(air_pollution)
+
+    report = {
+        'current': current_weather,
+        'forecast': forecast,
+        'air': air_data,
+        'solar': solar_data,
+        'radiation': radiation_data,
+    }
+    return report, None
+
+# --- Несколько городов в одном сообщении ---
+
+_CITY_LIST_SEPARATORS = re.compile(r"[;\n]+")
+# Код страны или штата в запросе OpenWeatherMap "город,штат,страна"
+_LOCATION_CODE_RE = re.compile(r"^[A-Za-z]{2}$")
+
+def parse_city_list(text):
+    """
+    Разбивает сообщение на список городов по запятым, точкам с запятой и
+    переводам строк. Части из двух латинских букв после запятой считаются
+    кодом штата или страны и остаются с городом: "London,GB" - один город.
+    Повторы (с точностью до нормализации) отбрасываются.
+    """
+    cities = []
+    seen = set()
+    for chunk in _CITY_LIST_SEPARATORS.split(text or ""):
+        names = []
+        for part in chunk.split(","):
+            part = part.strip()
+            # К городу можно добавить не больше двух кодов: штат и страну
+            if names and _LOCATION_CODE_RE.match(part) and names[-1].count(",") < 2:
+                names[-1] += "," + part
+            else:
+                names.append(part)
+        for name in names:
+            key = normalize_city_name(name)
+            if key and key not in seen:
+                seen.add(key)
+                cities.append(name)
+    return cities
+
+async def get_current_weather_group(city_ids, api_key):
+    """
+    Получает текущую погоду для набора id городов: сначала из кэша, остальное
+    через /group пачками до OWM_GROUP_SIZE id за вызов.
+    Возвращает словарь {id: данные}; города из неудавшихся пачек пропускаются.
+    """
+    result = {}
+    missing = []
+    for city_id in city_ids:
+        data = response_cache.get("current", location_cache_key({'id': city_id}))
+        if data is not None:
+            result[city_id] = data
+        elif city_id not in missing:
+            missing.append(city_id)
+
+    chunks = [missing[i:i + OWM_GROUP_SIZE] for i in range(0, len(missing), OWM_GROUP_SIZE)]
+    responses = await asyncio.gather(*(
+        fetch_owm_json(OWM_GROUP_URL, {
+            "id": ",".join(str(city_id) for city_id in chunk),
+            "appid": api_key,
+            "units": WEATHER_UNITS,
+            "lang": WEATHER_LANG,
+        }, "group")
+        for chunk in chunks
+    ), return_exceptions=True)
+
+    for chunk, response in zip(chunks, responses):
+        if isinstance(response, BaseException):
+            logger.warning("Ошибка группового запроса для %d городов: %s", len(chunk), response)
+            # Без свежих данных лучше показать устаревшие, чем ничего
+            for city_id in chunk:
+                stale = response_cache.get("current", location_cache_key({'id': city_id}), allow_stale=True)
+                if stale is not None:
+                    result[city_id] = stale
+            continue
+        for data in response.get('list', []):
+            response_cache.set("current", location_cache_key({'id': data['id']}), data)
+            result[data['id']] = data
+    return result
+
+async def collect_multi_city_report(city_names, api_key):
+    """
+    Собирает данные для нескольких городов одним проходом.
+
+    Названия разрешаются через кэш городов; уже известные города получают
+    текущую погоду одним запросом /group на каждые 20 id, неизвестные
+    разрешаются отдельными запросами /weather (при почти исчерпанном
+    бюджете API - не разрешаются вовсе). Прогнозы запрашиваются
+    параллельно с ограничением MULTI_CITY_CONCURRENCY, данные о солнечной
+    активности берутся из общего снимка один раз на всё сообщение.
+    Возвращает (rows, solar_data), где rows - список словарей с ключами
+    name, current, forecast и error в порядке исходного списка.
+    """
+    semaphore = asyncio.Semaphore(MULTI_CITY_CONCURRENCY)
+    economy = owm_budget.is_low()
+    rows = [{'name': name, 'location': None, 'current': None, 'forecast': None, 'error': None} for name in city_names]
+
+    unresolved = []
+    for row in rows:
+        cached, location = resolve_city(row['name'])
+        if cached and location is None:
+            row['error'] = CITY_NOT_FOUND_MESSAGE
+        elif location is not None and location.get('id'):
+            row['location'] = location
+        elif economy:
+            # Бюджет на исходе: отдельный запрос на каждое новое название не тратим
+            row['error'] = QUOTA_EXCEEDED_MESSAGE
+        else:
+            unresolved.append(row)
+
+    async def resolve_row(row):
+        async with semaphore:
+            try:
+                current = await get_current_weather(row['name'], api_key)
+            except (*UPSTREAM_ERRORS, ValueError) as err:
+                remember_city_result(row['name'], error=err)
+                row['error'] = describe_weather_error(err)
+                return
+        remember_city_result(row['name'], current)
+        row['location'] = location_from_weather(current)
+        row['current'] = current
+
+    resolved_ids = [row['location']['id'] for row in rows if row['location']]
+    current_by_id, _ = await asyncio.gather(
+        get_current_weather_group(resolved_ids, api_key),
+        asyncio.gather(*(resolve_row(row) for row in unresolved)),
+    )
+    for row in rows:
+        if row['current'] is None and row['location'] is not None:
+            row['current'] = current_by_id.get(row['location']['id'])
+            if row['current'] is None:
+                row['error'] = "Нет данных"
+        if row['current'] is not None:
+            record_location(row['location'])
+
+    async def forecast_row(row):
+        async with semaphore:
+            task = asyncio.ensure_future(get_forecast(row['location'], api_key, cache_only=economy))
+            row['forecast'] = await await_optional_source(
+                task, asyncio.get_running_loop().time() + SOURCE_DEADLINES["forecast"], "forecast")
+
+    await asyncio.gather(*(forecast_row(row) for row in rows if row['current'] is not None))
+    return rows, get_space_weather_snapshot()
+
+def _escape_pre(text: str) -> str:
+    """Экранирует текст внутри блока кода Markdown V2."""
+    return text.replace('\\', '\\\\').replace('`', '\\`')
+
+def forecast_range(forecast_data, slots=8):
+    """
+    Возвращает (мин, макс) температуры за ближайшие slots трёхчасовых интервалов.
+    """
+    return forecast_data.temp_range(slots) if forecast_data else None
+
+def format_multi_city_messages(rows, solar_data=None):
+    """
+    Форматирует сводную таблицу по нескольким городам в Markdown V2.
+    Длинная таблица разбивается на несколько сообщений в пределах лимита Telegram.
+    """
+    header = escape_markdown(f"Погода в {len(rows)} городах:") + "\n"
+    table_header = f"{'Город':<18}{'Сейчас':>7}{'Ощущ.':>7}{'24 ч':>12}  Описание"
+    lines = []
+    for row in rows:
+        current = row['current']
+        if current is None:
+            lines.append(f"{row['name'][:17]:<18}{row['error'] or 'Нет данных'}")
+            continue
+        place = f"{current['name']}, {current['sys']['country']}"[:17]
+        day_range = forecast_range(row['forecast'])
+        range_text = f"{day_range[0]:+.0f}..{day_range[1]:+.0f}°" if day_range else "-"
+        lines.append(
+            f"{place:<18}{current['main']['temp']:>+6.1f}°{current['main']['feels_like']:>+6.1f}°"
+            f"{range_text:>12}  {current['weather'][0]['description'][:24]}"
+        )
+
+    footer = ""
+    if solar_data:
+        footer = escape_markdown(f"☀️ Солнечная активность: класс {solar_data.get('flare_class', 'N/A')}, "
+                                 f"{solar_data.get('intensity', 'N/A')}") + "\n"
+
+    messages = []
+    current_lines = []
+    overhead = len(header) + len(footer) + len(table_header) + 16
+    size = overhead
+    for line in lines:
+        line = _escape_pre(line)
+        if current_lines and size + len(line) + 1 > TELEGRAM_MESSAGE_LIMIT:
+            messages.append(current_lines)
+            current_lines = []
+            size = overhead
+        current_lines.append(line)
+        size += len(line) + 1
+    if current_lines:
+        messages.append(current_lines)
+
+    texts = []
+    for index, chunk in enumerate(messages):
+        text = header if index == 0 else ""
+        text += "```\n" + _escape_pre(table_header) + "\n" + "\n".join(chunk) + "\n```\n"
+        if index == len(messages) - 1:
+            text += footer
+        texts.append(text)
+    return texts
+
 def format_air_quality_message(air_data):
     """
     Форматирует данные о качестве воздуха.
@@ -325,30 +1248,168 @@ def format_weather_message(current_data, forecast_data, air_data=None, solar_dat
     if radiation_data:
         message += format_radiation_message(radiation_data)
 
-    if forecast_data and forecast_data.get('list'):
+    if forecast_data:
         message += "\n*Прогноз на ближайшее время:*\n"
-        
-        forecast_by_day = {}
-        for item in forecast_data['list']:
-            date = item['dt_txt'].split(' ')[0] 
-            if date not in forecast_by_day:
-                forecast_by_day[date] = item
-                if len(forecast_by_day) >= 3: 
-                    break
-
-        for date, item in forecast_by_day.items():
-            temp_min = item['main']['temp_min']
-            temp_max = item['main']['temp_max']
-            description_forecast = item['weather'][0]['description']
+
+        # Дни считаются по местному времени города, мин/макс - за весь день
+        for day in forecast_data.daily(3):
             message += (
-                f"🗓️ *{date}*: {description_forecast.capitalize()}, "
-                f"темп. от {temp_min:.1f}°C до {temp_max:.1f}°C\n"
+                f"🗓️ *{day.date.isoformat()}*: {day.description.capitalize()}, "
+                f"темп. от {day.temp_min:.1f}°C до {day.temp_max:.1f}°C\n"
             )
 
     # Экранируем весь текст после форматирования
     message += "\n\nУ вас сегодня будет хорошое настроение"
     return escape_markdown(message)
 
+def reply_version_key(report):
+    """
+    Возвращает ключ версии ответа по отметкам времени входных данных.
+    Если изменился любой источник, меняется и ключ.
+    """
+    current = report['current']
+    forecast = report['forecast']
+    air = report['air']
+    radiation = report['radiation']
+    solar = report['solar']
+
+    forecast_dt = forecast.first_dt if forecast else None
+    air_dt = air['list'][0].get('dt') if air and air.get('list') else None
+    solar_version = (solar.get('flare_time'), solar.get('intensity')) if solar else None
+    return (
+        current.get('id'), current.get('name'), current.get('dt'),
+        forecast_dt, air_dt, radiation.get('uv_index') if radiation else None, solar_version,
+    )
+
+def render_weather_reply(report):
+    """
+    Возвращает готовый текст ответа в Markdown V2.
+    Текст кэшируется по версиям входных данных, поэтому одинаковые запросы
+    в пределах одного окна обновления данных не форматируются заново.
+    """
+    key = reply_version_key(report)
+    text = reply_cache.get("reply", key)
+    if text is None:
+        text = format_weather_message(report['current'], report['forecast'], report['air'], report['solar'], report['radiation'])
+        reply_cache.set("reply", key, text)
+    return text
+
+# --- Рассылка подписок ---
+
+async def send_broadcast_message(bot, chat_id, text) -> bool:
+    """
+    Отправляет сообщение рассылки с учётом лимитов Telegram.
+    Если пользователь заблокировал бота, удаляет его подписки.
+    """
+    for attempt in range(2):
+        await broadcast_sender.acquire(chat_id)
+        try:
+            with metrics.TELEGRAM_SEND_LATENCY.time("broadcast"):
+                await bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN_V2)
+            return True
+        except RetryAfter as e:
+            logger.warning("Telegram просит подождать %s с перед отправкой рассылки", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except Forbidden:
+            logger.info("Чат %s заблокировал бота, удаляю его подписки", chat_id)
+            subscription_store.remove(chat_id)
+            return False
+        except TelegramError as e:
+            logger.warning("Ошибка отправки рассылки в чат %s: %s", chat_id, e)
+            return False
+    return False
+
+async def run_subscription_tick(context) -> None:
+    """
+    Отправляет наступившие подписки.
+
+    Подписки группируются по месту: данные для каждого места запрашиваются
+    один раз за проход, каждый различный ответ форматируется один раз, а
+    сообщения отправляются параллельно - темп задаёт общий ограничитель
+    скорости. Подписки места переносятся на следующий день сразу после его
+    отправок, поэтому сбой на другом месте не приводит к повторной рассылке.
+    Время отправки каждого чата смещено внутри минуты, поэтому рассылка не
+    уходит одним всплеском.
+    """
+    global _subscription_tick_running
+    if _subscription_tick_running:
+        return
+    _subscription_tick_running = True
+    try:
+        now = time.time()
+        due = subscription_store.due(now)
+        if not due:
+            return
+
+        by_location = {}
+        expired = []
+        for subscription in due:
+            chat_id, location_key, location, local_minute, run_at = subscription
+            if now - run_at > SUBSCRIPTION_MAX_DELAY:
+                # Бот был выключен слишком долго - такой прогноз уже не актуален
+                expired.append(subscription)
+                continue
+            by_location.setdefault(location_key, []).append(subscription)
+        if expired:
+            subscription_store.reschedule(expired, now)
+
+        fetch_semaphore = asyncio.Semaphore(MULTI_CITY_CONCURRENCY)
+        send_semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+        async def send(chat_id, text):
+            async with send_semaphore:
+                await send_broadcast_message(context.bot, chat_id, text)
+
+        async def deliver(subscriptions):
+            location = subscriptions[0][2]
+            try:
+                async with fetch_semaphore:
+                    report, error = await collect_weather_report(location['name'], OPENWEATHER_API_KEY, location=location)
+                if report is None:
+                    # Подписка останется наступившей и будет повторена на следующем проходе
+                    logger.warning("Не удалось получить погоду для подписки на %s", location['name'])
+                    return
+                text = render_weather_reply(report)
+                results = await asyncio.gather(
+                    *(send(subscription[0], text) for subscription in subscriptions),
+                    return_exceptions=True,
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.error("Ошибка отправки подписки на %s: %s", location['name'], result)
+                # Смещение города меняется при переходе на летнее время - берём его из свежих данных
+                timezone = report['current'].get('timezone')
+                if timezone is not None:
+                    for subscription in subscriptions:
+                        subscription[2]['timezone'] = timezone
+                subscription_store.reschedule(subscriptions, now)
+            except Exception:
+                logger.exception("Ошибка рассылки подписок на %s", location['name'])
+
+        await asyncio.gather(*(deliver(subscriptions) for subscriptions in by_location.values()))
+        logger.info("Рассылка: %d подписок, %d мест", len(due), len(by_location))
+    finally:
+        _subscription_tick_running = False
+
+def schedule_subscription_job(application) -> None:
+    """
+    Регистрирует периодическую проверку подписок в job queue.
+    Рассылку ведёт только первый воркер: подписки общие для всех процессов,
+    и несколько планировщиков отправили бы одно сообщение несколько раз,
+    а их общая скорость превысила бы лимит Telegram.
+    """
+    if _worker_index != 0:
+        return
+    if application.job_queue is None:
+        logger.warning("job queue недоступна, подписки не будут рассылаться.")
+        return
+    application.job_queue.run_repeating(
+        run_subscription_tick,
+        interval=SUBSCRIPTION_TICK,
+        first=SUBSCRIPTION_TICK,
+        name="subscriptions",
+    )
+
 # --- Функции-обработчики для Telegram бота ---
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -357,81 +1418,281 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает команду /help."""
-    await update.message.reply_text('Чтобы узнать погоду, просто отправь мне название города (например, "Киев" или "London").')
+    await update.message.reply_text('Чтобы узнать погоду, просто отправь мне название города (например, "Киев" или "London"). '
+                                    'Можно указать несколько городов через запятую: "Киев, Львов, Одесса". '
+                                    'Ежедневный прогноз: /subscribe Киев 07:30, отписаться: /unsubscribe.')
 
 async def weather_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает текстовые сообщения от пользователя (название города)."""
+    metrics.IN_FLIGHT.inc("weather")
+    try:
+        with metrics.HANDLER_LATENCY.time("weather"):
+            await _weather_message(update)
+    finally:
+        metrics.IN_FLIGHT.dec("weather")
+
+async def _weather_message(update: Update) -> None:
     city_name = update.message.text
     
     if not OPENWEATHER_API_KEY:
         await update.message.reply_text("Ошибка: API ключ OpenWeatherMap не настроен. Пожалуйста, свяжитесь с администратором бота.")
         return
 
-    await update.message.reply_text(f"Ищу погоду в городе {city_name}...")
+    cities = parse_city_list(city_name)
+    # Каждый город списка стоит отдельных вызовов API, поэтому и токенов
+    # списывается по одному на город; отклонённый длинный список стоит один
+    cost = len(cities) if 1 < len(cities) <= MULTI_CITY_LIMIT else 1
+    if not user_rate_limiter.allow(update.effective_chat.id, cost):
+        await update.message.reply_text(USER_RATE_LIMITED_MESSAGE)
+        return
+
+    if len(cities) > 1:
+        await _multi_city_message(update, cities)
+        return
+
+    with metrics.TELEGRAM_SEND_LATENCY.time("reply_text"):
+        await update.message.reply_text(f"Ищу погоду в городе {city_name}...")
     
-    current_weather, forecast = get_weather_data(city_name, OPENWEATHER_API_KEY)
+    report, error = await collect_weather_report(city_name, OPENWEATHER_API_KEY)
 
-    if current_weather:
-        # Получаем координаты города
-        lat = current_weather['coord']['lat']
-        lon = current_weather['coord']['lon']
-        
-        # Получаем дополнительную информацию
-        air_data = get_air_quality_data(lat, lon, AIR_QUALITY_API_KEY)
-        solar_data = get_solar_activity_data()
-        radiation_data = get_radiation_data(lat, lon)
-        
-        print(f"Данные о качестве воздуха: {'Получены' if air_data else 'Не получены'}")
-        print(f"Данные о солнечной активности: {'Получены' if solar_data else 'Не получены'}")
-        print(f"Данные о радиации: {'Получены' if radiation_data else 'Не получены'}")
-        
-        weather_text = format_weather_message(current_weather, forecast, air_data, solar_data, radiation_data)
-        print("Длина сообщения:", len(weather_text))  # Для отладки
-        print("Первые 200 символов:", weather_text[:200])  # Для отладки
-        await update.message.reply_markdown_v2(weather_text)
+    if report:
+        logger.debug(
+            "Дополнительные данные: воздух=%s, солнце=%s, радиация=%s",
+            bool(report['air']), bool(report['solar']), bool(report['radiation']),
+        )
+        weather_text = render_weather_reply(report)
+        logger.debug("Длина сообщения: %d", len(weather_text))
+        with metrics.TELEGRAM_SEND_LATENCY.time("reply_markdown_v2"):
+            await update.message.reply_markdown_v2(weather_text)
+    else:
+        await update.message.reply_text(error or "Не удалось получить данные о погоде для этого города.")
+
+
+async def _multi_city_message(update: Update, cities) -> None:
+    if len(cities) > MULTI_CITY_LIMIT:
+        await update.message.reply_text(f"Слишком много городов. Можно указать не больше {MULTI_CITY_LIMIT} за раз.")
+        return
+
+    with metrics.TELEGRAM_SEND_LATENCY.time("reply_text"):
+        await update.message.reply_text(f"Ищу погоду в {len(cities)} городах...")
+
+    rows, solar_data = await collect_multi_city_report(cities, OPENWEATHER_API_KEY)
+    for text in format_multi_city_messages(rows, solar_data):
+        with metrics.TELEGRAM_SEND_LATENCY.time("reply_markdown_v2"):
+            await update.message.reply_markdown_v2(text)
+
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает команду /subscribe <город> <ЧЧ:ММ>."""
+    parsed = parse_subscribe_args(context.args or [])
+    if parsed is None:
+        await update.message.reply_text("Использование: /subscribe <город> <ЧЧ:ММ>, например /subscribe Киев 07:30. "
+                                        "Время указывается местное для города.")
+        return
+    city_name, local_minute = parsed
+
+    cached, location = resolve_city(city_name)
+    if not cached:
+        try:
+            current = await get_current_weather(city_name, OPENWEATHER_API_KEY)
+        except UPSTREAM_ERRORS as err:
+            remember_city_result(city_name, error=err)
+            await update.message.reply_text(describe_weather_error(err))
+            return
+        remember_city_result(city_name, current)
+        location = location_from_weather(current)
+    if location is None:
+        await update.message.reply_text(CITY_NOT_FOUND_MESSAGE)
+        return
+
+    if not subscription_store.add(update.effective_chat.id, location_cache_key(location), location, local_minute):
+        await update.message.reply_text(f"Можно подписаться не больше чем на {SUBSCRIPTIONS_PER_CHAT} городов.")
+        return
+    await update.message.reply_text(
+        f"Готово! Каждый день в {local_minute // 60:02d}:{local_minute % 60:02d} "
+        f"по местному времени пришлю прогноз для {location['name']}, {location['country']}."
+    )
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает команду /unsubscribe [город]."""
+    chat_id = update.effective_chat.id
+    city_name = " ".join(context.args or []).strip()
+    if not city_name:
+        removed = subscription_store.remove(chat_id)
     else:
-        await update.message.reply_text(forecast or "Не удалось получить данные о погоде для этого города.")
+        cached, location = resolve_city(city_name)
+        removed = subscription_store.remove(chat_id, location_cache_key(location)) if location else 0
+    if removed:
+        await update.message.reply_text(f"Подписки отменены: {removed}.")
+    else:
+        await update.message.reply_text("Подписок не найдено.")
 
+async def subscriptions_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает команду /subscriptions."""
+    subscriptions = subscription_store.list(update.effective_chat.id)
+    if not subscriptions:
+        await update.message.reply_text("У вас нет подписок. Подписаться: /subscribe <город> <ЧЧ:ММ>.")
+        return
+    lines = [
+        f"• {location['name']}, {location['country']} - {local_minute // 60:02d}:{local_minute % 60:02d}"
+        for location, local_minute in subscriptions
+    ]
+    await update.message.reply_text("Ваши подписки:\n" + "\n".join(lines))
 
 async def unknown_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отвечает на неизвестные команды или сообщения."""
     await update.message.reply_text("Извини, я не понимаю эту команду. Попробуй отправить название города или используй /help.")
 
-def main():
-    """Запускает бота."""
-    if not TELEGRAM_BOT_TOKEN:
-        print("Ошибка: Переменная окружения BOT_TOKEN не установлена. Пожалуйста, установите токен бота из BotFather.")
-        return
-    if not OPENWEATHER_API_KEY:
-        print("Ошибка: Переменная окружения OPENWEATHER_API_KEY не установлена. Пожалуйста, установите API ключ OpenWeatherMap.")
-        return
-    
-    # Предупреждения о дополнительных API ключах
-    if not AIR_QUALITY_API_KEY:
-        print("Предупреждение: AIR_QUALITY_API_KEY не установлен. Информация о качестве воздуха будет недоступна.")
-    if not SOLAR_API_KEY:
-        print("Предупреждение: SOLAR_API_KEY не установлен. Информация о солнечной активности будет ограничена.")
+def register_cache_metrics() -> None:
+    """Публикует счётчики кэшей, бюджета и выключателей как метрики, вычисляемые при сборе."""
+    caches = {"response": response_cache, "reply": reply_cache}
+
+    def collect():
+        values = {}
+        for name, cache in caches.items():
+            for field, value in cache.stats().items():
+                values[(name, field)] = value
+        return values
+
+    metrics.REGISTRY.callback_gauge("weather_cache", "Состояние кэшей: записи, попадания, промахи, доля попаданий", ("cache", "field"), collect)
+    metrics.REGISTRY.callback_gauge(
+        "weather_owm_budget_remaining_ratio", "Оставшаяся доля бюджета вызовов OpenWeatherMap", (),
+        lambda: {(): owm_budget.remaining_ratio()},
+    )
+
+    metrics.REGISTRY.callback_gauge(
+        "weather_circuit_open", "1, если выключатель источника разомкнут или проверяется пробой", ("source",),
+        lambda: {(name,): int(breaker.state != CircuitBreaker.CLOSED) for name, breaker in _circuit_breakers.items()},
+    )
+
+register_cache_metrics()
+metrics.STARTUP_SECONDS.set(time.perf_counter() - _process_started, "import")
+
+_metrics_runner = None
+_prewarm_task = None
+# Номер воркера в режиме webhook с несколькими процессами, 0 - единственный или первый
+_worker_index = 0
+
+async def on_startup(application: Application) -> None:
+    """
+    Подготавливает общие ресурсы перед запуском бота. Соединения с внешними
+    API открываются в фоне, чтобы не откладывать готовность.
+    """
+    global _metrics_runner, _prewarm_task
+    metrics.STARTUP_SECONDS.set(time.perf_counter() - _process_started, "init")
+    await open_http_session(application)
+    _prewarm_task = asyncio.create_task(prewarm_connections())
+    restored = restore_startup_snapshot()
+    # Каждый воркер отдаёт метрики на своём порту, иначе счётчики разных процессов смешаются
+    if METRICS_PORT:
+        try:
+            _metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT + _worker_index)
+        except OSError as e:
+            logger.warning("Не удалось запустить сервер метрик: %s", e)
+
+    startup_seconds = time.perf_counter() - _process_started
+    metrics.STARTUP_SECONDS.set(startup_seconds, "ready")
+    metrics.READY.set(1)
+    logger.info("Бот готов за %.2f с, восстановлено из снимка: %s", startup_seconds, restored)
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def on_shutdown(application: Application) -> None:
+    """Освобождает общие ресурсы после остановки бота."""
+    global _metrics_runner
+    metrics.READY.set(0)
+    if _prewarm_task is not None:
+        await cancel_tasks(_prewarm_task)
+    if _worker_index == 0:
+        save_startup_snapshot()
+    await close_http_session(application)
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+    logger.info("Статистика кэша ответов: %s", response_cache.stats())
+    logger.info("Статистика кэша готовых ответов: %s", reply_cache.stats())
+    logger.info("Отклонено вызовов OpenWeatherMap из-за бюджета: %d", owm_budget.rejected)
+    response_cache.close()
+    city_cache.close()
+    subscription_store.close()
+
+def build_application(worker_index=0) -> Application:
+    """
+    Создаёт Application с обработчиками и фоновыми задачами.
+    worker_index - номер процесса-воркера в режиме webhook.
+    """
+    global _worker_index
+    _worker_index = worker_index
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    schedule_space_weather_job(application)
+    schedule_subscription_job(application)
+    schedule_cache_warming_job(application)
+    schedule_snapshot_job(application)
 
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("subscriptions", subscriptions_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, weather_message))
     application.add_handler(MessageHandler(filters.COMMAND | filters.TEXT, unknown_message))
+    return application
 
-    print("Бот запущен! Отправь ему сообщение в Telegram.")
+def run_polling() -> None:
+    """Запускает бота в режиме long polling."""
+    application = build_application()
     try:
-        # Очищаем предыдущие обновления перед запуском
-        application.bot.delete_webhook(drop_pending_updates=True)
+        # run_polling сам удаляет webhook и очищает предыдущие обновления
         application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
     except Exception as e:
         if "Conflict" in str(e) or "terminated by other getUpdates request" in str(e):
-            print("Ошибка: Другой экземпляр бота уже запущен!")
-            print("Пожалуйста, остановите все другие экземпляры бота и попробуйте снова.")
-            print("Или подождите несколько секунд и попробуйте снова.")
+            logger.error("Другой экземпляр бота уже запущен! Остановите все другие экземпляры "
+                         "или подождите несколько секунд и попробуйте снова.")
         else:
-            print(f"Ошибка при запуске бота: {e}")
+            logger.error("Ошибка при запуске бота: %s", e)
+
+def main():
+    """Запускает бота."""
+    metrics.setup_logging(LOG_LEVEL, rate_per_minute=LOG_RATE_PER_MINUTE)
+
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("Переменная окружения BOT_TOKEN не установлена. Пожалуйста, установите токен бота из BotFather.")
+        return
+    if not OPENWEATHER_API_KEY:
+        logger.error("Переменная окружения OPENWEATHER_API_KEY не установлена. Пожалуйста, установите API ключ OpenWeatherMap.")
+        return
+    
+    # Предупреждения о дополнительных API ключах
+    if not AIR_QUALITY_API_KEY:
+        logger.warning("AIR_QUALITY_API_KEY не установлен. Информация о качестве воздуха будет недоступна.")
+    if not SOLAR_API_KEY:
+        logger.warning("SOLAR_API_KEY не установлен. Информация о солнечной активности будет ограничена.")
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            logger.error("Для режима webhook нужно указать WEBHOOK_URL.")
+            return
+        if not WEBHOOK_SECRET:
+            logger.warning("WEBHOOK_SECRET не установлен. Запросы к webhook не будут проверяться.")
+        from webhook import run_webhook
+        logger.info("Бот запущен в режиме webhook (%d воркер(ов))! Отправь ему сообщение в Telegram.", WEB_WORKERS)
+        run_webhook(
+            build_application,
+            WEBHOOK_HOST,
+            WEBHOOK_PORT,
+            WEBHOOK_PATH,
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            workers=WEB_WORKERS,
+        )
         return
 
+    logger.info("Бот запущен! Отправь ему сообщение в Telegram.")
+    run_polling()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,244 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+from ratelimit import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# --- Метрики в формате Prometheus ---
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    """Монотонно растущий счётчик с необязательными метками."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться."""
+
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class CallbackGauge:
+    """
+    Gauge, значения которого вычисляются при каждом сборе метрик.
+    callback возвращает словарь {кортеж_меток: значение}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        for labels, value in self.callback().items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, наблюдение за O(log корзин)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            # Счётчики по корзинам, последняя - +Inf; затем сумма и количество
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield self.name + "_bucket", _format_labels(self.labelnames, labels, [("le", le)]), cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), total
+            yield self.name + "_count", _format_labels(self.labelnames, labels), count
+
+
+class Registry:
+    """Набор метрик процесса и их отрисовка в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback_gauge(self, name, documentation, labelnames, callback):
+        return self.register(CallbackGauge(name, documentation, labelnames, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "weather_upstream_request_seconds", "Задержка запросов к внешним API", ("source",))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "weather_upstream_errors_total", "Ошибки запросов к внешним API по классу исключения", ("source", "exception"))
+HANDLER_LATENCY = REGISTRY.histogram(
+    "weather_handler_seconds", "Полное время обработки сообщения", ("handler",))
+TELEGRAM_SEND_LATENCY = REGISTRY.histogram(
+    "weather_telegram_send_seconds", "Задержка отправки сообщений в Telegram", ("method",))
+IN_FLIGHT = REGISTRY.gauge(
+    "weather_in_flight_requests", "Число обрабатываемых сейчас сообщений", ("handler",))
+READY = REGISTRY.gauge(
+    "weather_ready", "1, когда бот запущен и готов отвечать")
+STARTUP_SECONDS = REGISTRY.gauge(
+    "weather_startup_seconds", "Время от старта процесса до готовности, по этапам", ("stage",))
+CACHE_WARM_REFRESHES = REGISTRY.counter(
+    "weather_cache_warm_refreshes_total", "Записи кэша, обновлённые фоновым прогревом", ("source",))
+
+
+# --- HTTP-эндпоинт /metrics ---
+# aiohttp.web импортируется только при запуске сервера, чтобы не замедлять старт
+
+async def handle_metrics(request):
+    """Отдаёт все метрики процесса в текстовом формате Prometheus."""
+    from aiohttp import web
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+async def handle_ready(request):
+    """Отвечает 200, когда бот готов, и 503 во время запуска и остановки."""
+    from aiohttp import web
+    if READY.value():
+        return web.json_response({"status": "ok"})
+    return web.json_response({"status": "starting"}, status=503)
+
+async def start_metrics_server(host, port):
+    """
+    Запускает отдельный aiohttp-сервер с эндпоинтами /metrics и /ready.
+    Возвращает runner, который нужно закрыть через runner.cleanup().
+    """
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/ready", handle_ready)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
+
+
+# --- Логирование ---
+
+class RateLimitedFilter(logging.Filter):
+    """
+    Ограничивает частоту одинаковых сообщений журнала: для каждого шаблона
+    сообщения и уровня действует свой token bucket. Сообщения уровня ERROR
+    и выше не ограничиваются.
+    """
+
+    def __init__(self, rate_per_minute=30, burst=10, max_keys=1000):
+        super().__init__()
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self._buckets = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.levelno, record.msg)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        if bucket.try_acquire():
+            return True
+        self.suppressed += 1
+        return False
+
+def setup_logging(level="INFO", rate_per_minute=30, burst=10):
+    """Настраивает журнал процесса с ограничением частоты сообщений."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(RateLimitedFilter(rate_per_minute, burst))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # Библиотеки HTTP пишут каждый запрос на уровне INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
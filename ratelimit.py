@@ -0,0 +1,116 @@
+import time
+
+
+# --- Ограничение частоты запросов ---
+
+class QuotaExceeded(Exception):
+    """Бюджет вызовов внешнего API исчерпан."""
+
+
+class TokenBucket:
+    """
+    Классический token bucket: ёмкость capacity, пополнение rate токенов в секунду.
+    Проверка выполняется за O(1) и не создаёт новых объектов.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def try_acquire(self, amount=1, now=None):
+        """
+        Забирает amount токенов, если они есть. Возвращает True при успехе.
+        """
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def fill_ratio(self, now=None):
+        """
+        Возвращает долю оставшихся токенов от 0 до 1.
+        """
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens / self.capacity
+
+
+class KeyedRateLimiter:
+    """
+    Набор token bucket по ключу (например, id чата).
+    Число хранимых ключей ограничено: при переполнении вытесняются самые старые.
+    """
+
+    def __init__(self, rate, capacity, max_keys=100000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, amount=1):
+        """
+        Возвращает True и списывает amount токенов, если для ключа они есть.
+        Запрос дороже ёмкости корзины проходит только при полной корзине и
+        уводит её в минус: ключ ждёт, пока не восстановится весь долг.
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+        if not bucket.try_acquire(min(amount, bucket.capacity)):
+            return False
+        bucket.tokens -= max(0, amount - bucket.capacity)
+        return True
+
+
+class QuotaBudget:
+    """
+    Бюджет вызовов внешнего API с поминутным и суточным лимитами.
+    """
+
+    def __init__(self, per_minute, per_day, low_watermark=0.2):
+        self.minute = TokenBucket(per_minute / 60.0, per_minute)
+        self.day = TokenBucket(per_day / 86400.0, per_day)
+        self.low_watermark = low_watermark
+        self.rejected = 0
+
+    def try_spend(self, amount=1):
+        """
+        Списывает вызовы из обоих лимитов. Возвращает False, если бюджета нет.
+        """
+        now = time.monotonic()
+        self.minute._refill(now)
+        self.day._refill(now)
+        if self.minute.tokens < amount or self.day.tokens < amount:
+            self.rejected += 1
+            return False
+        self.minute.tokens -= amount
+        self.day.tokens -= amount
+        return True
+
+    def remaining_ratio(self):
+        """
+        Возвращает оставшуюся долю бюджета по самому строгому из лимитов.
+        """
+        now = time.monotonic()
+        return min(self.minute.fill_ratio(now), self.day.fill_ratio(now))
+
+    def is_low(self):
+        """
+        Возвращает True, когда бюджет почти исчерпан и пора экономить вызовы.
+        """
+        return self.remaining_ratio() < self.low_watermark
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import deque
+
+
+# --- Защита от деградировавших внешних сервисов ---
+
+class CircuitOpenError(Exception):
+    """Источник временно отключён автоматическим выключателем."""
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для одного внешнего источника.
+
+    После failure_threshold неудач подряд (ошибок или вызовов дольше
+    slow_call_threshold) источник размыкается и вызовы к нему сразу
+    отклоняются. Через reset_timeout пропускается одна пробная попытка
+    (полуоткрытое состояние): её успех замыкает цепь, неудача - снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, slow_call_threshold=5.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self):
+        """
+        Возвращает True, если вызов можно выполнить сейчас.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        # Полуоткрытое состояние: одновременно идёт только одна проба
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self, duration=0.0):
+        if duration > self.slow_call_threshold:
+            self.record_failure()
+            return
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """
+        Освобождает пробу без вывода о состоянии источника (например, при отмене вызова).
+        """
+        self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """
+    Хранит последние задержки источника и оценивает их перцентиль.
+    """
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    def observe(self, value):
+        self._samples.append(value)
+        self._sorted = None
+
+    def percentile(self, fraction, default=None):
+        if not self._samples:
+            return default
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        index = min(len(self._sorted) - 1, int(fraction * len(self._sorted)))
+        return self._sorted[index]
+
+
+async def hedged(func, delay, attempts=2):
+    """
+    Выполняет func() с подстраховкой: если ответа нет через delay секунд,
+    запускает ещё одну попытку и возвращает первый успешный результат.
+    Ошибка без ожидания не повторяется; если все попытки завершились
+    ошибкой, пробрасывается последняя из них.
+    """
+    tasks = [asyncio.ensure_future(func())]
+    launched = 1
+    last_error = None
+    try:
+        while tasks:
+            timeout = delay if launched < attempts else None
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                tasks.append(asyncio.ensure_future(func()))
+                launched += 1
+                continue
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from ratelimit import KeyedRateLimiter, TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3])[:.]([0-5]\d)$")
+
+
+# --- Подписки на ежедневный прогноз ---
+
+def parse_subscribe_args(args):
+    """
+    Разбирает аргументы /subscribe вида ["Киев", "07:30"].
+    Возвращает (город, минута_суток) или None, если формат неверный.
+    """
+    if len(args) < 2:
+        return None
+    match = _TIME_RE.match(args[-1])
+    city = " ".join(args[:-1]).strip()
+    if not match or not city:
+        return None
+    return city, int(match.group(1)) * 60 + int(match.group(2))
+
+def spread_offset(chat_id, window=60):
+    """
+    Детерминированное смещение в секундах внутри минуты для чата, чтобы
+    рассылка одной минуты не уходила одним всплеском.
+    """
+    return zlib.crc32(str(chat_id).encode()) % window
+
+def next_run_at(local_minute, tz_offset, chat_id, now=None):
+    """
+    Возвращает ближайший момент (UTC, epoch) отправки для времени local_minute
+    по местному времени города со смещением tz_offset секунд от UTC.
+    """
+    now = time.time() if now is None else now
+    local_now = now + tz_offset
+    local_day_start = local_now - local_now % 86400
+    candidate = local_day_start + local_minute * 60 + spread_offset(chat_id)
+    if candidate <= local_now:
+        candidate += 86400
+    return candidate - tz_offset
+
+
+class SubscriptionStore:
+    """
+    Хранилище подписок в SQLite. Одна подписка - пара (чат, город)
+    с местным временем отправки и моментом следующей отправки.
+    """
+
+    def __init__(self, path, max_per_chat=5):
+        self.path = path
+        self.max_per_chat = max_per_chat
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS subscriptions ("
+                " chat_id INTEGER NOT NULL, location_key TEXT NOT NULL,"
+                " location TEXT NOT NULL, local_minute INTEGER NOT NULL,"
+                " next_run_at REAL NOT NULL,"
+                " PRIMARY KEY (chat_id, location_key))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS subscriptions_next_run ON subscriptions (next_run_at)")
+        return self._db
+
+    def add(self, chat_id, location_key, location, local_minute):
+        """
+        Добавляет подписку или меняет время существующей.
+        Возвращает False, если у чата уже максимум подписок.
+        """
+        run_at = next_run_at(local_minute, location.get('timezone') or 0, chat_id)
+        with self._lock:
+            db = self._connect()
+            with db:
+                count, exists = db.execute(
+                    "SELECT COUNT(*), SUM(location_key = ?) FROM subscriptions WHERE chat_id = ?",
+                    (location_key, chat_id),
+                ).fetchone()
+                if not exists and count >= self.max_per_chat:
+                    return False
+                db.execute(
+                    "INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, location_key, json.dumps(location, ensure_ascii=False), local_minute, run_at),
+                )
+        return True
+
+    def remove(self, chat_id, location_key=None):
+        """
+        Удаляет подписку на город или все подписки чата. Возвращает число удалённых.
+        """
+        with self._lock:
+            db = self._connect()
+            with db:
+                if location_key is None:
+                    cursor = db.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+                else:
+                    cursor = db.execute(
+                        "DELETE FROM subscriptions WHERE chat_id = ? AND location_key = ?", (chat_id, location_key))
+        return cursor.rowcount
+
+    def list(self, chat_id):
+        """
+        Возвращает подписки чата как список (location, local_minute).
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT location, local_minute FROM subscriptions WHERE chat_id = ? ORDER BY local_minute",
+                (chat_id,),
+            ).fetchall()
+        return [(json.loads(location), local_minute) for location, local_minute in rows]
+
+    def due(self, now=None, limit=10000):
+        """
+        Возвращает подписки, время отправки которых наступило:
+        список (chat_id, location_key, location, local_minute, next_run_at).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT chat_id, location_key, location, local_minute, next_run_at FROM subscriptions"
+                " WHERE next_run_at <= ? ORDER BY next_run_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+        return [(chat_id, key, json.loads(location), minute, run_at) for chat_id, key, location, minute, run_at in rows]
+
+    def reschedule(self, subscriptions, now=None):
+        """
+        Переносит отправку подписок на следующий день. Место сохраняется
+        заново, чтобы обновлённое смещение часового пояса (летнее время)
+        учитывалось и в следующих отправках.
+        """
+        now = time.time() if now is None else now
+        rows = [
+            (next_run_at(local_minute, location.get('timezone') or 0, chat_id, now),
+             json.dumps(location, ensure_ascii=False), chat_id, location_key)
+            for chat_id, location_key, location, local_minute, _ in subscriptions
+        ]
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "UPDATE subscriptions SET next_run_at = ?, location = ? WHERE chat_id = ? AND location_key = ?",
+                    rows)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class BroadcastSender:
+    """
+    Отправка рассылки с соблюдением лимитов Telegram: общий token bucket
+    (около 30 сообщений в секунду) и отдельный лимит для каждого чата.
+    Когда токена нет, отправка ждёт, а не отбрасывается.
+    """
+
+    def __init__(self, global_rate=30.0, per_chat_rate=1.0, burst=5):
+        self._global = TokenBucket(global_rate, burst)
+        self._per_chat = KeyedRateLimiter(per_chat_rate, 1, max_keys=100000)
+        self._global_rate = global_rate
+        self._per_chat_rate = per_chat_rate
+
+    async def acquire(self, chat_id):
+        while not self._per_chat.allow(chat_id):
+            await asyncio.sleep(1.0 / self._per_chat_rate)
+        while not self._global.try_acquire():
+            await asyncio.sleep(1.0 / self._global_rate)
@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+# main configures its caches from the environment at import time
+_cache_dir = tempfile.mkdtemp()
+os.environ.setdefault("CITY_CACHE_PATH", os.path.join(_cache_dir, "cache.sqlite3"))
+os.environ.setdefault("SUBSCRIPTIONS_PATH", os.path.join(_cache_dir, "subscriptions.sqlite3"))
+os.environ.setdefault("SNAPSHOT_PATH", "")
+
+from main import parse_city_list
+
+
+def test_country_code_stays_with_city():
+    assert parse_city_list("London,GB") == ["London,GB"]
+
+
+def test_state_and_country_codes_stay_with_city():
+    assert parse_city_list("Austin,TX,US") == ["Austin,TX,US"]
+
+
+def test_at_most_two_codes_are_merged():
+    assert parse_city_list("Austin,TX,US,GB") == ["Austin,TX,US", "GB"]
+
+
+def test_mixed_separators():
+    assert parse_city_list("Kyiv, Lviv; Odesa") == ["Kyiv", "Lviv", "Odesa"]
+    assert parse_city_list("Kyiv\nLviv;;Odesa") == ["Kyiv", "Lviv", "Odesa"]
+
+
+def test_code_after_list_city_is_merged():
+    assert parse_city_list("Kyiv, London, GB; Paris") == ["Kyiv", "London,GB", "Paris"]
+
+
+def test_duplicates_after_normalization_are_dropped():
+    assert parse_city_list("Kyiv; KYIV, kyiv ") == ["Kyiv"]
+    assert parse_city_list("Киев, киев; КИЕВ") == ["Киев"]
+    assert parse_city_list("Орёл, Орел") == ["Орёл"]
+
+
+def test_empty_parts_are_skipped():
+    assert parse_city_list(" , ;\n") == []
+    assert parse_city_list("Kyiv,,  ,Lviv") == ["Kyiv", "Lviv"]
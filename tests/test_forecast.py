@@ -0,0 +1,86 @@
+from datetime import date
+
+from forecast import CompactForecast
+
+# 2023-11-14 00:00:00 UTC
+MIDNIGHT_UTC = 1699920000
+
+
+def slot(dt, temp_min, temp_max, description="ясно", condition_id=800):
+    return {
+        "dt": dt,
+        "main": {"temp": (temp_min + temp_max) / 2, "temp_min": temp_min, "temp_max": temp_max},
+        "weather": [{"id": condition_id, "description": description}],
+    }
+
+
+def payload(slots, timezone=0):
+    return {
+        "list": slots,
+        "city": {"id": 1, "name": "Test", "country": "XX", "coord": {"lat": 1.5, "lon": 2.5}, "timezone": timezone},
+    }
+
+
+def test_daily_aggregates_whole_local_day():
+    slots = [slot(MIDNIGHT_UTC + i * 10800, 10 + i, 12 + i) for i in range(8)]
+    (day,) = CompactForecast.from_payload(payload(slots)).daily()
+    assert day.date == date(2023, 11, 14)
+    assert day.temp_min == 10
+    assert day.temp_max == 19
+
+
+def test_day_boundary_is_shifted_by_positive_timezone():
+    # UTC+3: the slot at 21:00 UTC is already 00:00 of the next local day
+    slots = [slot(MIDNIGHT_UTC + i * 10800, i, i) for i in range(9)]
+    days = CompactForecast.from_payload(payload(slots, timezone=3 * 3600)).daily()
+    assert [d.date for d in days] == [date(2023, 11, 14), date(2023, 11, 15)]
+    assert (days[0].temp_min, days[0].temp_max) == (0, 6)
+    assert (days[1].temp_min, days[1].temp_max) == (7, 8)
+
+
+def test_day_boundary_is_shifted_by_negative_timezone():
+    # UTC-5: 00:00 and 03:00 UTC still belong to the previous local day
+    slots = [slot(MIDNIGHT_UTC + i * 10800, i, i) for i in range(4)]
+    days = CompactForecast.from_payload(payload(slots, timezone=-5 * 3600)).daily()
+    assert [d.date for d in days] == [date(2023, 11, 13), date(2023, 11, 14)]
+    assert (days[0].temp_min, days[0].temp_max) == (0, 1)
+    assert (days[1].temp_min, days[1].temp_max) == (2, 3)
+
+
+def test_daily_stops_after_requested_number_of_days():
+    slots = [slot(MIDNIGHT_UTC + i * 10800, 0, 1) for i in range(40)]
+    days = CompactForecast.from_payload(payload(slots)).daily(3)
+    assert [d.date.day for d in days] == [14, 15, 16]
+
+
+def test_dominant_condition_is_most_frequent_then_earliest():
+    slots = [
+        slot(MIDNIGHT_UTC, 0, 1, "дождь", 500),
+        slot(MIDNIGHT_UTC + 10800, 0, 1, "облачно", 803),
+        slot(MIDNIGHT_UTC + 21600, 0, 1, "облачно", 803),
+        slot(MIDNIGHT_UTC + 86400, 0, 1, "снег", 600),
+        slot(MIDNIGHT_UTC + 86400 + 10800, 0, 1, "дождь", 500),
+    ]
+    first, second = CompactForecast.from_payload(payload(slots)).daily()
+    assert (first.description, first.condition_id) == ("облачно", 803)
+    assert (second.description, second.condition_id) == ("снег", 600)
+
+
+def test_empty_forecast():
+    forecast = CompactForecast.from_payload({"list": []})
+    assert not forecast
+    assert forecast.daily() == []
+    assert forecast.temp_range() is None
+    assert forecast.first_dt is None
+    assert forecast.location() is None
+
+
+def test_dict_roundtrip_and_legacy_payload():
+    raw = payload([slot(MIDNIGHT_UTC + i * 10800, i, i + 1.25) for i in range(8)], timezone=7200)
+    forecast = CompactForecast.from_payload(raw)
+    restored = CompactForecast.from_dict(forecast.to_dict())
+    assert list(restored.dt) == list(forecast.dt)
+    assert restored.timezone == 7200
+    assert restored.temp_range(8) == forecast.temp_range(8)
+    assert restored.location() == {'id': 1, 'lat': 1.5, 'lon': 2.5}
+    assert CompactForecast.from_dict(raw).first_dt == MIDNIGHT_UTC
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, hedged
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30.0, slow_call_threshold=5.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_slow_call_counts_as_failure(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, slow_call_threshold=5.0)
+    breaker.record_success(6.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_allows_single_probe_and_closes_on_success(clock):
+    breaker = open_breaker(clock)
+    clock[0] += 29.0
+    assert not breaker.allow()
+    clock[0] += 1.0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = open_breaker(clock)
+    clock[0] += 30.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock[0] += 30.0
+    assert breaker.allow()
+
+
+def test_released_probe_can_be_retried(clock):
+    breaker = open_breaker(clock)
+    clock[0] += 30.0
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+class Attempts:
+    """Вызовы с заданными задержками и результатами по порядку запуска."""
+
+    def __init__(self, *plan):
+        self.plan = list(plan)
+        self.started = 0
+        self.cancelled = []
+
+    async def __call__(self):
+        index = self.started
+        self.started += 1
+        delay, result = self.plan[index]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_fast_call_is_not_hedged():
+    attempts = Attempts((0.0, "first"), (0.0, "second"))
+    assert asyncio.run(hedged(attempts, delay=0.05)) == "first"
+    assert attempts.started == 1
+
+
+def test_slow_call_is_hedged_and_loser_cancelled():
+    attempts = Attempts((1.0, "slow"), (0.0, "hedge"))
+
+    async def run():
+        result = await hedged(attempts, delay=0.01)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "hedge"
+    assert attempts.started == 2
+    assert attempts.cancelled == [0]
+
+
+def test_first_result_wins_when_original_finishes_first():
+    attempts = Attempts((0.03, "original"), (1.0, "hedge"))
+
+    async def run():
+        result = await hedged(attempts, delay=0.01)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "original"
+    assert attempts.cancelled == [1]
+
+
+def test_early_error_is_not_retried():
+    attempts = Attempts((0.0, ValueError("boom")), (0.0, "hedge"))
+    with pytest.raises(ValueError):
+        asyncio.run(hedged(attempts, delay=0.05))
+    assert attempts.started == 1
+
+
+def test_failed_hedge_falls_back_to_original():
+    attempts = Attempts((0.05, "original"), (0.0, ValueError("hedge failed")))
+    assert asyncio.run(hedged(attempts, delay=0.01)) == "original"
+
+
+def test_all_attempts_failing_raises_last_error():
+    attempts = Attempts((0.03, KeyError("first")), (0.0, ValueError("second")))
+    with pytest.raises(KeyError):
+        asyncio.run(hedged(attempts, delay=0.01))
@@ -0,0 +1,61 @@
+from subscriptions import SubscriptionStore, next_run_at, spread_offset
+
+# 2023-11-14 00:00:00 UTC
+MIDNIGHT_UTC = 1699920000
+DAY = 86400
+HOUR = 3600
+CHAT = 42
+
+
+def test_local_minute_is_converted_to_utc_for_positive_offset():
+    # 07:30 in UTC+2 is 05:30 UTC
+    run_at = next_run_at(7 * 60 + 30, 2 * HOUR, CHAT, now=MIDNIGHT_UTC)
+    assert run_at == MIDNIGHT_UTC + 5 * HOUR + 30 * 60 + spread_offset(CHAT)
+
+
+def test_local_minute_is_converted_to_utc_for_negative_offset():
+    # 07:30 in UTC-5 is 12:30 UTC
+    run_at = next_run_at(7 * 60 + 30, -5 * HOUR, CHAT, now=MIDNIGHT_UTC)
+    assert run_at == MIDNIGHT_UTC + 12 * HOUR + 30 * 60 + spread_offset(CHAT)
+
+
+def test_local_day_differs_from_utc_day():
+    # At 23:00 UTC it is already 02:00 of the next day in UTC+3,
+    # so 07:00 local is 04:00 UTC of the next UTC day
+    now = MIDNIGHT_UTC + 23 * HOUR
+    run_at = next_run_at(7 * 60, 3 * HOUR, CHAT, now=now)
+    assert run_at == MIDNIGHT_UTC + DAY + 4 * HOUR + spread_offset(CHAT)
+
+
+def test_passed_time_rolls_over_to_next_day():
+    now = MIDNIGHT_UTC + 8 * HOUR
+    run_at = next_run_at(7 * 60, 0, CHAT, now=now)
+    assert run_at == MIDNIGHT_UTC + DAY + 7 * HOUR + spread_offset(CHAT)
+
+
+def test_exact_run_time_rolls_over_to_next_day():
+    run_at = next_run_at(7 * 60, 0, CHAT, now=MIDNIGHT_UTC + 7 * HOUR + spread_offset(CHAT))
+    assert run_at == MIDNIGHT_UTC + DAY + 7 * HOUR + spread_offset(CHAT)
+
+
+def test_spread_offset_stays_within_minute():
+    assert all(0 <= spread_offset(chat_id) < 60 for chat_id in range(1000))
+    assert spread_offset(CHAT) == spread_offset(CHAT)
+
+
+def test_reschedule_stores_refreshed_timezone(tmp_path):
+    store = SubscriptionStore(str(tmp_path / "subscriptions.sqlite3"))
+    location = {'id': 1, 'name': "Kyiv", 'lat': 50.45, 'lon': 30.52, 'timezone': 2 * HOUR}
+    try:
+        assert store.add(CHAT, "id:1", location, 7 * 60)
+        (subscription,) = store.due(now=float("inf"))
+        # Daylight saving time started: the city is now UTC+3
+        subscription[2]['timezone'] = 3 * HOUR
+        store.reschedule([subscription], now=MIDNIGHT_UTC)
+
+        (stored,) = store.due(now=float("inf"))
+        assert stored[2]['timezone'] == 3 * HOUR
+        assert stored[4] == MIDNIGHT_UTC + 4 * HOUR + spread_offset(CHAT)
+        assert store.list(CHAT) == [(stored[2], 7 * 60)]
+    finally:
+        store.close()
@@ -0,0 +1,135 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передаёт секретный токен webhook
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# --- Встроенный webhook-сервер на aiohttp ---
+
+def create_webhook_app(application, path, secret_token=None):
+    """
+    Создаёт aiohttp-приложение, принимающее обновления Telegram на path
+    и отдающее состояние бота на /health. Метрики сюда не попадают: порт
+    webhook открыт наружу, а метрики каждый воркер отдаёт на своём порту.
+    """
+    async def handle_update(request):
+        if secret_token:
+            received = request.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(received, secret_token):
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return web.Response()
+
+    async def health(request):
+        if application.running:
+            return web.json_response({"status": "ok"})
+        return web.json_response({"status": "starting"}, status=503)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/health", health)
+    return app
+
+async def serve_webhook(application, host, port, path, webhook_url=None, secret_token=None, reuse_port=False):
+    """
+    Запускает Application и webhook-сервер и работает до SIGINT/SIGTERM.
+    Если передан webhook_url, регистрирует его в Telegram.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows не поддерживает обработчики сигналов в цикле событий
+            pass
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    runner = web.AppRunner(create_webhook_app(application, path, secret_token))
+    await runner.setup()
+    try:
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+            )
+        await application.start()
+        site = web.TCPSite(runner, host, port, reuse_port=reuse_port or None)
+        await site.start()
+        logger.info("Webhook-сервер слушает %s:%s%s", host, port, path)
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def _webhook_worker(build_application, index, options):
+    """
+    Точка входа процесса-воркера: строит своё Application с номером воркера
+    и обслуживает общий порт. Регистрирует webhook в Telegram только первый воркер.
+    """
+    webhook_url = options["webhook_url"] if index == 0 else None
+    asyncio.run(serve_webhook(
+        build_application(worker_index=index),
+        options["host"],
+        options["port"],
+        options["path"],
+        webhook_url=webhook_url,
+        secret_token=options["secret_token"],
+        reuse_port=options["reuse_port"],
+    ))
+
+def run_webhook(build_application, host, port, path, webhook_url, secret_token=None, workers=1):
+    """
+    Запускает бота в режиме webhook. При workers > 1 поднимает несколько
+    процессов, которые делят один порт через SO_REUSEPORT.
+    """
+    options = {
+        "host": host,
+        "port": port,
+        "path": path,
+        "webhook_url": webhook_url,
+        "secret_token": secret_token,
+        "reuse_port": workers > 1,
+    }
+    if workers <= 1:
+        _webhook_worker(build_application, 0, options)
+        return
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_webhook_worker, args=(build_application, index, options), name=f"webhook-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()